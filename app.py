@@ -1,31 +1,67 @@
 import os
-import requests
-from flask import Flask, request, jsonify, send_file
+import json
+import time
+from utils import startup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-from utils.gemini_chat import get_gemini_response
-from utils.itinerary import create_itinerary_pdf
-from utils.location import get_place_details
+from werkzeug.middleware.proxy_fix import ProxyFix
+from utils.gemini_chat import get_gemini_response, get_model_stats
+from utils.itinerary import (
+    create_itinerary_pdf, create_simple_pdf_fallback, is_heading_line, render_itinerary_pdf,
+    strip_reply_preamble, summarize_itinerary_sections
+)
+from utils.itinerary_store import (
+    save_itinerary, get_itinerary, update_itinerary_section, render_artifact, temporary_render_path
+)
+from utils.location import get_place_details, get_coordinates
+from utils.cache import cache_stats
+from utils.admission import (
+    AdmissionRejected, admission_control, admission_stats, charge, limiter, render_gate, require_stats_token,
+    run_with_priority,
+    PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BULK
+)
 
-app = Flask(__name__)
+api = Blueprint('api', __name__)
 
 # Environment-based configuration
 NODE_SERVER_URL = os.getenv('NODE_SERVER_URL', 'http://localhost:3001')
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
 
-# CORS configuration - allow multiple origins for deployment
-CORS(app, origins=[
-    FRONTEND_URL,
-    "http://localhost:3000",  # Development
-    "https://your-app-name.netlify.app",  # Production (replace with your actual domain)
-    "https://your-app-name.vercel.app"   # Alternative deployment
-], methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+# Reverse proxies in front of the app; X-Forwarded-For is only honoured when this is set
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
 
-@app.route('/api/destination/<place>', methods=['GET'])
+# Batch itinerary generation; each trip costs one itinerary token, so a batch is
+# never larger than that bucket's burst
+BATCH_MAX_TRIPS = int(os.getenv('BATCH_MAX_TRIPS', limiter.burst('itinerary')))
+if BATCH_MAX_TRIPS > limiter.burst('itinerary'):
+    print(f"BATCH_MAX_TRIPS={BATCH_MAX_TRIPS} exceeds the itinerary burst; capping at {limiter.burst('itinerary')} (raise RATE_LIMIT_ITINERARY instead)")
+    BATCH_MAX_TRIPS = limiter.burst('itinerary')
+BATCH_GEMINI_CONCURRENCY = int(os.getenv('BATCH_GEMINI_CONCURRENCY', 4))
+BATCH_GEOCODE_CONCURRENCY = int(os.getenv('BATCH_GEOCODE_CONCURRENCY', 2))
+
+# Shared across requests so batch work is bounded process-wide
+_gemini_pool = ThreadPoolExecutor(max_workers=BATCH_GEMINI_CONCURRENCY, thread_name_prefix='batch-gemini')
+_render_pool = ThreadPoolExecutor(max_workers=int(os.getenv('RENDER_MAX_CONCURRENCY', 2)), thread_name_prefix='batch-render')
+
+# Import heavy SDKs before serving; with a pre-forking server this runs once before workers fork
+WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', '').lower() in ('1', 'true', 'yes')
+
+@api.app_errorhandler(AdmissionRejected)
+def handle_admission_rejected(error):
+    response = jsonify({"error": error.message, "retryAfter": error.retry_after})
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@api.route('/api/destination/<place>', methods=['GET'])
+@admission_control('destination', priority=PRIORITY_STANDARD)
 def destination(place):
     data = get_place_details(place)
     return jsonify(data)
 
-@app.route('/api/chat', methods=['POST'])
+@api.route('/api/chat', methods=['POST'])
+@admission_control('chat', priority=PRIORITY_INTERACTIVE)
 def chat():
     user_input = request.json.get("message")
     location = request.json.get("location")
@@ -37,20 +73,7 @@ def chat():
     reply = get_gemini_response(user_input, location_info)
     return jsonify({"reply": reply})
 
-@app.route('/api/itinerary', methods=['POST'])
-def itinerary():
-    selected_places = request.json.get("places")
-    user_location = request.json.get("userLocation")
-    days = request.json.get("days")
-    budget = request.json.get("budget")
-    people = request.json.get("people")
-    template_id = request.json.get("template", "modern")
-    format_type = request.json.get("format", "pdf")
-    return_text = request.json.get("returnText", False)
-    
-    if format_type != "pdf":
-        format_type = "pdf"
-    
+def _itinerary_prompt(selected_places, user_location, days, budget, people):
     personalization = ""
     if days:
         personalization += f"For {days} days. "
@@ -63,22 +86,12 @@ def itinerary():
     else:
         start_point = ""
     
-    itinerary_text = get_gemini_response(
-        f"{start_point}{personalization}Create a detailed travel itinerary for: {', '.join(selected_places)}. Suggest the best order, time to spend at each, and what to do at each place. Include tips and local insights.", ""
-    )
-    
-    from utils.location import get_coordinates
-    places_with_coords = []
-    for name in selected_places:
-        coords = get_coordinates(name)
-        if coords:
-            places_with_coords.append({"name": name, "coords": coords})
-    
-    options = {"days": days, "budget": budget, "people": people}
-    
-    # Save adventure to Node.js server
-    auth_header = request.headers.get('Authorization')
+    return f"{start_point}{personalization}Create a detailed travel itinerary for: {', '.join(selected_places)}. Suggest the best order, time to spend at each, and what to do at each place. Include tips and local insights."
+
+def _save_adventure(auth_header, selected_places, places_with_coords, itinerary_text, options):
+    """Forward a generated itinerary to the Node.js server for signed-in users"""
     if auth_header and selected_places and itinerary_text:
+        import requests
         try:
             # Prepare data for Node.js server
             adventure_data = {
@@ -103,22 +116,267 @@ def itinerary():
                 
         except Exception as e:
             print(f"Error saving adventure: {e}")
+
+@api.route('/api/itinerary', methods=['POST'])
+@admission_control('itinerary', priority=PRIORITY_STANDARD)
+def itinerary():
+    selected_places = request.json.get("places")
+    user_location = request.json.get("userLocation")
+    days = request.json.get("days")
+    budget = request.json.get("budget")
+    people = request.json.get("people")
+    template_id = request.json.get("template", "modern")
+    format_type = request.json.get("format", "pdf")
+    return_text = request.json.get("returnText", False)
+    
+    if format_type != "pdf":
+        format_type = "pdf"
+    
+    itinerary_text = get_gemini_response(
+        _itinerary_prompt(selected_places, user_location, days, budget, people), "", task="itinerary"
+    )
+    
+    places_with_coords = []
+    for name in selected_places:
+        coords = get_coordinates(name)
+        if coords:
+            places_with_coords.append({"name": name, "coords": coords})
+    
+    options = {"days": days, "budget": budget, "people": people}
+    
+    # Save adventure to Node.js server
+    _save_adventure(request.headers.get('Authorization'), selected_places, places_with_coords, itinerary_text, options)
+    
+    # Keep the itinerary server-side so later downloads only need its id; if the
+    # store is down, still answer from the local entry, just without an id
+    entry, stored = save_itinerary(itinerary_text, places=places_with_coords, options=options)
+    itinerary_id = entry['id'] if stored else None
     
     # Handle preview request or return text request
     if request.args.get("preview") == "1" or return_text:
-        return jsonify({"reply": itinerary_text})
+        return jsonify({
+            "reply": itinerary_text,
+            "itineraryId": itinerary_id,
+            "sections": _section_summaries(entry)
+        })
+    
+    pdf_path, cached = _render_stored_itinerary(entry, template_id)
+    response = _send_pdf(pdf_path, f"itinerary_{template_id}.pdf", cached,
+                         etag=_render_etag(entry, template_id) if stored else False)
+    if stored:
+        response.headers['X-Itinerary-Id'] = itinerary_id
+    return response
+
+# Generate itineraries for many trips in one request, streamed back as NDJSON
+@api.route('/api/itinerary/batch', methods=['POST'])
+@admission_control('batch', priority=PRIORITY_BULK)
+def itinerary_batch():
+    trips = (request.json or {}).get("trips") or []
+    if not isinstance(trips, list) or not trips:
+        return jsonify({"error": "trips must be a non-empty list"}), 400
+    if len(trips) > BATCH_MAX_TRIPS:
+        return jsonify({"error": f"At most {BATCH_MAX_TRIPS} trips per batch"}), 400
+    for trip in trips:
+        places = trip.get("places") if isinstance(trip, dict) else None
+        if not isinstance(places, list) or not places or not all(isinstance(name, str) and name.strip() for name in places):
+            return jsonify({"error": "Every trip needs a non-empty list of place names"}), 400
     
-    from utils.itinerary import create_itinerary_pdf
-    pdf_buffer = create_itinerary_pdf(itinerary_text, places=places_with_coords, options=options, template_id=template_id)
+    refund = charge('itinerary', len(trips))
+    
+    auth_header = request.headers.get('Authorization')
+    
+    # Geocode each distinct place once for the whole batch
+    unique_places = list(dict.fromkeys(name for trip in trips for name in trip["places"]))
+    with ThreadPoolExecutor(max_workers=BATCH_GEOCODE_CONCURRENCY) as geocode_pool:
+        coordinates = dict(zip(unique_places, geocode_pool.map(get_coordinates, unique_places)))
+    
+    def generate(trip):
+        itinerary_text = get_gemini_response(
+            _itinerary_prompt(trip["places"], trip.get("userLocation"), trip.get("days"), trip.get("budget"), trip.get("people")),
+            "", task="itinerary"
+        )
+        if not itinerary_text or itinerary_text.startswith("Error:"):
+            raise RuntimeError(itinerary_text or "Itinerary generation failed")
+        
+        places_with_coords = [{"name": name, "coords": coordinates[name]} for name in trip["places"] if coordinates.get(name)]
+        options = {"days": trip.get("days"), "budget": trip.get("budget"), "people": trip.get("people")}
+        _save_adventure(auth_header, trip["places"], places_with_coords, itinerary_text, options)
+        entry, stored = save_itinerary(itinerary_text, places=places_with_coords, options=options)
+        if not stored:
+            # Batch results are only reachable by id, so an unstored itinerary is lost
+            raise RuntimeError("Itinerary could not be stored, try again later")
+        return entry
+    
+    def render(entry, template_id):
+        pdf_path, cached = _render_stored_itinerary(entry, template_id)
+        if not cached:
+            # Fallback output is not kept; the client can retry the pdf URL later
+            _remove_file(pdf_path)
+        return cached
+    
+    def results():
+        generating = {
+            _gemini_pool.submit(run_with_priority, PRIORITY_BULK, generate, trip): index
+            for index, trip in enumerate(trips)
+        }
+        rendering = {}
+        
+        # Hand each itinerary to the render pool as soon as its text is ready
+        for future in as_completed(generating):
+            index = generating[future]
+            try:
+                entry = future.result()
+            except AdmissionRejected as e:
+                # Turned away before generating anything, so the trip's token goes back
+                refund()
+                yield {"index": index, "error": e.message, "retryAfter": e.retry_after}
+                continue
+            except Exception as e:
+                yield {"index": index, "error": str(e)}
+                continue
+            
+            template_id = trips[index].get("template")
+            if template_id:
+                render_future = _render_pool.submit(run_with_priority, PRIORITY_BULK, render, entry, template_id)
+                rendering[render_future] = (index, entry, template_id)
+            else:
+                yield _batch_result(index, entry)
+        
+        for future in as_completed(rendering):
+            index, entry, template_id = rendering[future]
+            try:
+                rendered = future.result()
+            except Exception as e:
+                print(f"Batch render failed for trip {index}: {e}")
+                rendered = False
+            yield _batch_result(index, entry, template_id, rendered)
+    
+    return Response(
+        stream_with_context(json.dumps(result) + "\n" for result in results()),
+        mimetype="application/x-ndjson"
+    )
+
+def _batch_result(index, entry, template_id="modern", rendered=False):
+    return {
+        "index": index,
+        "itineraryId": entry['id'],
+        "reply": entry['text'],
+        "sections": _section_summaries(entry),
+        "pdfUrl": f"/api/itinerary/{entry['id']}/pdf?template={template_id}",
+        "rendered": rendered
+    }
+
+def _render_stored_itinerary(entry, template_id):
+    """Return (path, cached) of the stored itinerary's PDF, rendering it on a cache miss"""
+    def render(output_path):
+        # PDF compiles are CPU-heavy; queue them behind interactive work
+        with render_gate.slot(PRIORITY_BULK):
+            if render_itinerary_pdf(entry['document'], entry['text'], places=entry['places'],
+                                    template_id=template_id, output_path=output_path, fallback=False):
+                return True
+            # A failed compile may be transient (e.g. a timeout under load), so its fallback is not cached
+            create_simple_pdf_fallback(entry['text'], entry['places'], template_id, output_path)
+            return False
+    return render_artifact(entry, template_id, render)
+
+def _render_etag(entry, template_id):
+    return f"{entry['id']}-{entry['revision']}-{template_id}"
+
+def _send_pdf(path, download_name, cached, etag=False):
+    """Stream a PDF from disk; cached artifacts get ETag/Range support, one-off files are removed right away"""
+    if not cached:
+        # Unlink while keeping the handle open; the data goes away once the response is sent
+        pdf_file = open(path, 'rb')
+        _remove_file(path)
+        return send_file(
+            pdf_file,
+            as_attachment=True,
+            download_name=download_name,
+            mimetype="application/pdf"
+        )
     return send_file(
-        pdf_buffer, 
-        as_attachment=True, 
-        download_name=f"itinerary_{template_id}.pdf",
-        mimetype="application/pdf"
+        path,
+        as_attachment=True,
+        download_name=download_name,
+        mimetype="application/pdf",
+        conditional=True,
+        etag=etag
+    )
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def _section_summaries(entry):
+    if entry is None:
+        return []
+    return [{"index": i, "title": section['title']} for i, section in enumerate(entry['document']['sections'])]
+
+# Regenerate a single day/section of a stored itinerary
+@api.route('/api/itinerary/<itinerary_id>/sections/<int:section_index>/regenerate', methods=['POST'])
+@admission_control('itinerary', priority=PRIORITY_STANDARD)
+def regenerate_itinerary_section(itinerary_id, section_index):
+    entry = get_itinerary(itinerary_id)
+    if entry is None:
+        return jsonify({"error": "Itinerary not found or expired"}), 404
+    
+    sections = entry['document']['sections']
+    if section_index < 0 or section_index >= len(sections):
+        return jsonify({"error": "Section not found"}), 404
+    
+    instructions = (request.json or {}).get("instructions", "")
+    section = sections[section_index]
+    context = summarize_itinerary_sections(sections, exclude_index=section_index)
+    
+    new_markdown = get_gemini_response(
+        f"You are editing one section of an existing travel itinerary. The rest of the itinerary is summarized below; keep the rewritten section consistent with it and do not repeat it.\n"
+        f"Other sections:\n{context}\n\n"
+        f"Current section:\n{section['markdown']}\n\n"
+        f"Change request: {instructions or 'Improve this section with fresh suggestions.'}\n"
+        f"Return ONLY the rewritten section in markdown, starting with the same heading: {section['title']}", "", task="itinerary"
     )
+    if not new_markdown or new_markdown.startswith("Error:"):
+        return jsonify({"error": new_markdown or "Regeneration failed"}), 502
+    
+    new_markdown = new_markdown.strip()
+    if is_heading_line(section['markdown'].lstrip().split('\n', 1)[0]):
+        new_markdown = strip_reply_preamble(new_markdown).strip()
+    # Keep a blank line before the next section's heading
+    try:
+        entry = update_itinerary_section(itinerary_id, section_index, new_markdown + "\n")
+    except ValueError as e:
+        print(f"Rejected regenerated section: {e}")
+        return jsonify({"error": "Regenerated section did not match the itinerary's structure, please try again"}), 502
+    except TimeoutError:
+        return jsonify({"error": "Itinerary is being updated, try again shortly"}), 503, {"Retry-After": "1"}
+    if entry is None:
+        return jsonify({"error": "Itinerary not found or expired"}), 404
+    
+    return jsonify({
+        "itineraryId": itinerary_id,
+        "section": {"index": section_index, "title": entry['document']['sections'][section_index]['title'], "markdown": new_markdown},
+        "reply": entry['text'],
+        "sections": _section_summaries(entry)
+    })
+
+# Render a stored itinerary without re-uploading its text
+@api.route('/api/itinerary/<itinerary_id>/pdf', methods=['GET'])
+@admission_control('download', priority=PRIORITY_BULK)
+def stored_itinerary_pdf(itinerary_id):
+    template_id = request.args.get("template", "modern")
+    entry = get_itinerary(itinerary_id)
+    if entry is None:
+        return jsonify({"error": "Itinerary not found or expired"}), 404
+    
+    pdf_path, cached = _render_stored_itinerary(entry, template_id)
+    destination = entry['document']['destination']
+    return _send_pdf(pdf_path, f"{destination}_itinerary_{template_id}.pdf", cached, etag=_render_etag(entry, template_id))
 
 # New endpoint for downloading existing itinerary
-@app.route('/api/itinerary/download', methods=['POST'])
+@api.route('/api/itinerary/download', methods=['POST'])
+@admission_control('download', priority=PRIORITY_BULK)
 def download_itinerary():
     itinerary_text = request.json.get("itineraryText")
     places = request.json.get("places", [])
@@ -134,23 +392,70 @@ def download_itinerary():
     
     options = {"days": days, "budget": budget, "people": people}
     
-    from utils.itinerary import create_itinerary_pdf
-    pdf_buffer = create_itinerary_pdf(itinerary_text, places=places, options=options, template_id=template_id)
-    return send_file(
-        pdf_buffer, 
-        as_attachment=True, 
-        download_name=f"{destination}_itinerary_{template_id}.pdf",
-        mimetype="application/pdf"
-    )
+    pdf_path = temporary_render_path()
+    try:
+        with render_gate.slot(PRIORITY_BULK):
+            create_itinerary_pdf(itinerary_text, places=places, options=options, template_id=template_id, output_path=pdf_path)
+    except Exception:
+        _remove_file(pdf_path)
+        raise
+    return _send_pdf(pdf_path, f"{destination}_itinerary_{template_id}.pdf", cached=False)
+
+@api.route('/api/models/stats', methods=['GET'])
+@admission_control('stats', priority=PRIORITY_BULK)
+@require_stats_token
+def model_stats():
+    return jsonify(get_model_stats())
 
-@app.route('/health', methods=['GET'])
+@api.route('/api/cache/stats', methods=['GET'])
+@admission_control('stats', priority=PRIORITY_BULK)
+@require_stats_token
+def cache_statistics():
+    return jsonify(cache_stats())
+
+@api.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
         "status": "healthy",
         "node_server": NODE_SERVER_URL,
+        "queues": admission_stats(),
+        "startup": startup.startup_report(),
         "environment": os.getenv('FLASK_ENV', 'development')
     })
 
+def create_app():
+    """Build the Flask app; heavy clients are initialized lazily or by the optional warm-up"""
+    startup.record_phase('imports', time.time() - startup.PROCESS_STARTED)
+    
+    with startup.phase('create_app'):
+        app = Flask(__name__)
+        if TRUSTED_PROXY_HOPS:
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+        
+        # CORS configuration - allow multiple origins for deployment
+        CORS(app, origins=[
+            FRONTEND_URL,
+            "http://localhost:3000",  # Development
+            "https://your-app-name.netlify.app",  # Production (replace with your actual domain)
+            "https://your-app-name.vercel.app"   # Alternative deployment
+        ], methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+        
+        app.register_blueprint(api)
+        
+        @app.after_request
+        def record_first_request(response):
+            startup.mark_request()
+            return response
+    
+    if WARM_UP_ON_START:
+        with startup.phase('warm_up'):
+            startup.warm_up()
+    
+    startup.mark_ready()
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     port = int(os.getenv('FLASK_PORT', 5000))  # Use FLASK_PORT instead of PORT
     debug = os.getenv('FLASK_ENV') == 'development'
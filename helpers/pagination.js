@@ -0,0 +1,67 @@
+const mongoose = require('mongoose');
+
+const DEFAULT_LIMIT = 10;
+const MAX_LIMIT = 50;
+
+// Opaque cursor over the (createdAt, _id) sort key
+const encodeCursor = (doc) =>
+  Buffer.from(`${new Date(doc.createdAt).toISOString()}|${doc._id}`).toString('base64url');
+
+const decodeCursor = (cursor) => {
+  const [createdAt, id] = Buffer.from(cursor, 'base64url').toString('utf8').split('|');
+  const date = new Date(createdAt);
+  if (!id || Number.isNaN(date.getTime()) || !mongoose.Types.ObjectId.isValid(id)) {
+    return null;
+  }
+  return { createdAt: date, _id: new mongoose.Types.ObjectId(id) };
+};
+
+// Keyset condition for documents after the cursor in the given sort order
+const cursorFilter = (cursor, order) => {
+  const op = order === 1 ? '$gt' : '$lt';
+  return {
+    $or: [
+      { createdAt: { [op]: cursor.createdAt } },
+      { createdAt: cursor.createdAt, _id: { [op]: cursor._id } }
+    ]
+  };
+};
+
+const parseLimit = (value, defaultLimit = DEFAULT_LIMIT, maxLimit = MAX_LIMIT) => {
+  const limit = parseInt(value) || defaultLimit;
+  return Math.min(Math.max(limit, 1), maxLimit);
+};
+
+// Parse ?cursor, ?limit and ?order; returns null for a malformed cursor
+const parsePageQuery = (query, defaultLimit, maxLimit) => {
+  const order = query.order === 'asc' ? 1 : -1;
+  const limit = parseLimit(query.limit, defaultLimit, maxLimit);
+  let after = null;
+  if (query.cursor) {
+    after = decodeCursor(query.cursor);
+    if (!after) {
+      return null;
+    }
+  }
+  return { order, limit, after };
+};
+
+// Trim the extra look-ahead document and build the response page
+const buildPage = (docs, limit) => {
+  const hasMore = docs.length > limit;
+  const items = hasMore ? docs.slice(0, limit) : docs;
+  return {
+    items,
+    hasMore,
+    nextCursor: hasMore ? encodeCursor(items[items.length - 1]) : null
+  };
+};
+
+module.exports = {
+  encodeCursor,
+  decodeCursor,
+  cursorFilter,
+  parseLimit,
+  parsePageQuery,
+  buildPage
+};
@@ -42,4 +42,7 @@ const adventureSchema = new mongoose.Schema({
   }
 });
 
+// Supports the per-user keyset-paginated list, newest first
+adventureSchema.index({ userId: 1, createdAt: -1, _id: -1 });
+
 module.exports = mongoose.model('Adventure', adventureSchema);
\ No newline at end of file
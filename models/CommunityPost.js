@@ -95,4 +95,7 @@ const communityPostSchema = new mongoose.Schema({
   }
 });
 
+// Supports the keyset-paginated feed on (createdAt, _id)
+communityPostSchema.index({ createdAt: -1, _id: -1 });
+
 module.exports = mongoose.model('CommunityPost', communityPostSchema);
\ No newline at end of file
@@ -1,6 +1,7 @@
 const express = require('express');
 const Adventure = require('../models/Adventure');
 const auth = require('../middleware/auth');
+const { cursorFilter, parsePageQuery, buildPage } = require('../helpers/pagination');
 
 const router = express.Router();
 
@@ -29,14 +30,31 @@ router.post('/', auth, async (req, res) => {
   }
 });
 
-// Get user's adventures (only those with itineraries)
+// Get user's adventures (only those with itineraries), cursor-paginated
+// List items leave out the itinerary text; fetch it with GET /:id
 router.get('/', auth, async (req, res) => {
   try {
-    const adventures = await Adventure.find({ 
+    const page = parsePageQuery(req.query, 20, 100);
+    if (!page) {
+      return res.status(400).json({ message: 'Invalid cursor' });
+    }
+
+    const filter = {
       userId: req.user._id,
       'itinerary.text': { $exists: true, $ne: '' }
-    }).sort({ createdAt: -1 });
-    res.json(adventures);
+    };
+    if (page.after) {
+      Object.assign(filter, cursorFilter(page.after, page.order));
+    }
+
+    const adventures = await Adventure.find(filter)
+      .select('destination places options itinerary.generatedAt createdAt')
+      .sort({ createdAt: page.order, _id: page.order })
+      .limit(page.limit + 1)
+      .lean();
+
+    const { items, hasMore, nextCursor } = buildPage(adventures, page.limit);
+    res.json({ adventures: items, hasMore, nextCursor });
   } catch (error) {
     res.status(500).json({ message: error.message });
   }
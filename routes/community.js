@@ -2,39 +2,123 @@ const express = require('express');
 const CommunityPost = require('../models/CommunityPost');
 const Adventure = require('../models/Adventure');
 const auth = require('../middleware/auth');
+const { cursorFilter, parsePageQuery, buildPage } = require('../helpers/pagination');
 
 const router = express.Router();
 
-// Get all community posts with pagination  
+// Get community feed, cursor-paginated on (createdAt, _id)
+// Posts carry like/comment counts only; comments and itineraries are fetched per post
 router.get('/', async (req, res) => {
   try {
-    const page = parseInt(req.query.page) || 1;
-    const limit = parseInt(req.query.limit) || 10;
-    const skip = (page - 1) * limit;
-    const sortBy = req.query.sortBy || 'createdAt';
-    const order = req.query.order === 'asc' ? 1 : -1;
+    const page = parsePageQuery(req.query);
+    if (!page) {
+      return res.status(400).json({ message: 'Invalid cursor' });
+    }
+
+    const match = page.after ? cursorFilter(page.after, page.order) : {};
+    const posts = await CommunityPost.aggregate([
+      { $match: match },
+      { $sort: { createdAt: page.order, _id: page.order } },
+      { $limit: page.limit + 1 },
+      {
+        $project: {
+          userId: 1,
+          title: 1,
+          story: 1,
+          adventureId: 1,
+          media: 1,
+          tags: 1,
+          createdAt: 1,
+          updatedAt: 1,
+          likesCount: { $size: { $ifNull: ['$likes', []] } },
+          commentsCount: { $size: { $ifNull: ['$comments', []] } }
+        }
+      }
+    ]);
+
+    await CommunityPost.populate(posts, [
+      { path: 'userId', select: 'username', options: { lean: true } },
+      { path: 'adventureId', select: 'destination places options', options: { lean: true } }
+    ]);
+
+    const { items, hasMore, nextCursor } = buildPage(posts, page.limit);
+    res.json({ posts: items, hasMore, nextCursor });
+  } catch (error) {
+    console.error('Error fetching community posts:', error);
+    res.status(500).json({ 
+      error: 'Internal server error',
+      message: error.message 
+    });
+  }
+});
 
-    const posts = await CommunityPost.find()
+// Get a single post with its comment tree
+router.get('/:id', async (req, res) => {
+  try {
+    const post = await CommunityPost.findById(req.params.id)
       .populate('userId', 'username')
-      .populate('adventureId', 'destination places options itinerary')
+      .populate('adventureId', 'destination places options')
       .populate('comments.userId', 'username')
       .populate('comments.replies.userId', 'username')
-      .sort({ [sortBy]: order })
-      .skip(skip)
-      .limit(limit);
+      .lean();
 
-    const total = await CommunityPost.countDocuments();
+    if (!post) {
+      return res.status(404).json({ message: 'Post not found' });
+    }
 
-    const response = {
-      posts,
-      currentPage: page,
-      totalPages: Math.ceil(total / limit),
-      totalPosts: total
-    };
+    res.json(post);
+  } catch (error) {
+    console.error('Error fetching post:', error);
+    res.status(500).json({ 
+      error: 'Internal server error',
+      message: error.message 
+    });
+  }
+});
 
-    res.json(response);
+// Get only the comments of a post
+router.get('/:id/comments', async (req, res) => {
+  try {
+    const post = await CommunityPost.findById(req.params.id)
+      .select('comments')
+      .populate('comments.userId', 'username')
+      .populate('comments.replies.userId', 'username')
+      .lean();
+
+    if (!post) {
+      return res.status(404).json({ message: 'Post not found' });
+    }
+
+    res.json(post.comments);
   } catch (error) {
-    console.error('Error fetching community posts:', error);
+    console.error('Error fetching comments:', error);
+    res.status(500).json({ 
+      error: 'Internal server error',
+      message: error.message 
+    });
+  }
+});
+
+// Get the itinerary shared with a post
+router.get('/:id/itinerary', async (req, res) => {
+  try {
+    const post = await CommunityPost.findById(req.params.id).select('adventureId').lean();
+
+    if (!post || !post.adventureId) {
+      return res.status(404).json({ message: 'Itinerary not found' });
+    }
+
+    const adventure = await Adventure.findById(post.adventureId)
+      .select('destination itinerary')
+      .lean();
+
+    if (!adventure) {
+      return res.status(404).json({ message: 'Itinerary not found' });
+    }
+
+    res.json(adventure);
+  } catch (error) {
+    console.error('Error fetching itinerary:', error);
     res.status(500).json({ 
       error: 'Internal server error',
       message: error.message 
@@ -66,7 +150,7 @@ router.put('/:id', auth, async (req, res) => {
     
     const updatedPost = await CommunityPost.findById(post._id)
       .populate('userId', 'username')
-      .populate('adventureId', 'destination places options itinerary');
+      .populate('adventureId', 'destination places options');
 
     res.json(updatedPost);
   } catch (error) {
@@ -107,7 +191,7 @@ router.post('/', auth, async (req, res) => {
     
     const populatedPost = await CommunityPost.findById(post._id)
       .populate('userId', 'username')
-      .populate('adventureId', 'destination places options itinerary');
+      .populate('adventureId', 'destination places options');
 
     res.status(201).json(populatedPost);
   } catch (error) {
@@ -0,0 +1,4 @@
+import os
+
+# Keep test runs off the shared on-disk cache
+os.environ.setdefault('CACHE_BACKEND', 'memory')
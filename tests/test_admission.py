@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from utils.admission import (
+    Overloaded, PriorityGate, RateLimited, SharedTokenBuckets, TokenBucketLimiter
+)
+from utils.cache import MemoryBackend, NamespaceCache, SQLiteBackend
+
+LIMITS = {'user': (5, 50.0), 'chat': (2, 20.0)}
+
+
+def test_bucket_allows_burst_then_rejects_with_retry_after():
+    limiter = TokenBucketLimiter(LIMITS)
+    limiter.consume('ip:1', ['chat'])
+    limiter.consume('ip:1', ['chat'])
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.consume('ip:1', ['chat'])
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after >= 1
+    limiter.consume('ip:2', ['chat'])
+
+
+def test_bucket_refills_over_time():
+    limiter = TokenBucketLimiter(LIMITS)
+    limiter.consume('ip:1', ['chat'], count=2)
+    time.sleep(0.06)
+    limiter.consume('ip:1', ['chat'])
+
+
+def test_rejected_consume_takes_no_tokens():
+    limiter = TokenBucketLimiter(LIMITS)
+    limiter.consume('ip:1', ['chat'], count=2)
+    for _ in range(3):
+        with pytest.raises(RateLimited):
+            limiter.consume('ip:1', ['user', 'chat'])
+    limiter.consume('ip:1', ['user'], count=5)
+
+
+def test_shared_buckets_are_shared_across_workers(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    first = SharedTokenBuckets(LIMITS, NamespaceCache(SQLiteBackend(path), 'ratelimits'))
+    second = SharedTokenBuckets(LIMITS, NamespaceCache(SQLiteBackend(path), 'ratelimits'))
+    first.consume('ip:1', ['user', 'chat'])
+    second.consume('ip:1', ['user', 'chat'])
+    with pytest.raises(RateLimited):
+        first.consume('ip:1', ['user', 'chat'])
+    with pytest.raises(RateLimited):
+        second.consume('ip:1', ['chat'])
+    second.consume('ip:2', ['chat'])
+
+
+def test_shared_buckets_use_local_buckets_for_a_per_process_backend():
+    limiter = SharedTokenBuckets(LIMITS, NamespaceCache(MemoryBackend(), 'ratelimits'))
+    limiter.consume('ip:1', ['chat'], count=2)
+    with pytest.raises(RateLimited):
+        limiter.consume('ip:1', ['chat'])
+    assert limiter.local._buckets
+
+
+def test_shared_buckets_fall_back_when_the_backend_fails():
+    class Down(MemoryBackend):
+        shared = True
+
+        def add(self, *args, **kwargs):
+            raise ConnectionError('backend down')
+
+    limiter = SharedTokenBuckets(LIMITS, NamespaceCache(Down(), 'ratelimits'))
+    limiter.consume('ip:1', ['chat'], count=2)
+    with pytest.raises(RateLimited):
+        limiter.consume('ip:1', ['chat'])
+
+
+def _queue(gate, priority, order):
+    def run():
+        with gate.slot(priority):
+            order.append(priority)
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.05)
+    return thread
+
+
+def test_gate_admits_waiters_by_priority_then_fifo():
+    gate = PriorityGate('test', limit=1, max_queue=10, wait_timeout=5)
+    order = []
+    gate.acquire(0)
+    threads = [_queue(gate, priority, order) for priority in (2, 1, 0, 1)]
+    assert gate.stats() == {'limit': 1, 'active': 1, 'queued': 4}
+    gate.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 1, 2]
+    assert gate.stats() == {'limit': 1, 'active': 0, 'queued': 0}
+
+
+def test_gate_times_out_waiters():
+    gate = PriorityGate('test', limit=1, max_queue=10, wait_timeout=0.1)
+    gate.acquire(0)
+    start = time.time()
+    with pytest.raises(Overloaded):
+        gate.acquire(0)
+    assert 0.1 <= time.time() - start < 1
+    assert gate.stats()['queued'] == 0
+
+
+def test_gate_rejects_when_queue_is_full():
+    gate = PriorityGate('test', limit=1, max_queue=1, wait_timeout=5)
+    gate.acquire(0)
+    waiter = threading.Thread(target=gate.acquire, args=(0,))
+    waiter.start()
+    time.sleep(0.05)
+    start = time.time()
+    with pytest.raises(Overloaded) as excinfo:
+        gate.acquire(0)
+    assert time.time() - start < 0.5
+    assert excinfo.value.status_code == 503
+    gate.release()
+    waiter.join()
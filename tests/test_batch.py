@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from utils.admission import Overloaded, limiter
+
+ITINERARY = "## Day 1: Arrival\n* Beach\n\n## Tips\n* Sunscreen"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    limiter.local._buckets.clear()
+    geocoded = []
+    geocode_lock = threading.Lock()
+
+    def get_coordinates(place):
+        with geocode_lock:
+            geocoded.append(place)
+        return [15.0, 74.0]
+
+    monkeypatch.setattr(app_module, 'get_coordinates', get_coordinates)
+    monkeypatch.setattr(app_module, '_save_adventure', lambda *args: None)
+    monkeypatch.setattr(app_module, 'get_gemini_response', lambda *args, **kwargs: ITINERARY)
+    client = app_module.app.test_client()
+    client.geocoded = geocoded
+    return client
+
+
+def post_batch(client, trips):
+    response = client.post('/api/itinerary/batch', json={'trips': trips})
+    lines = [json.loads(line) for line in response.data.decode().splitlines()] if response.status_code == 200 else None
+    return response, lines
+
+
+def itinerary_tokens():
+    tokens, _ = limiter.local._buckets[('ip:127.0.0.1', 'itinerary')]
+    return tokens
+
+
+def test_batch_streams_one_result_per_trip_and_geocodes_each_place_once(client):
+    response, lines = post_batch(client, [
+        {'places': ['Goa', 'Panaji']},
+        {'places': ['Goa', 'Calangute'], 'days': 2},
+        {'places': ['Panaji']},
+    ])
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert sorted(line['index'] for line in lines) == [0, 1, 2]
+    assert sorted(client.geocoded) == ['Calangute', 'Goa', 'Panaji']
+    for line in lines:
+        assert line['reply'] == ITINERARY
+        assert [section['title'] for section in line['sections']] == ['Day 1: Arrival', 'Tips']
+        assert line['pdfUrl'] == f"/api/itinerary/{line['itineraryId']}/pdf?template=modern"
+        assert app_module.get_itinerary(line['itineraryId'])['text'] == ITINERARY
+
+
+def test_batch_results_arrive_in_completion_order(client, monkeypatch):
+    def get_gemini_response(prompt, location, task):
+        if 'Slow' in prompt:
+            time.sleep(0.3)
+        return ITINERARY
+
+    monkeypatch.setattr(app_module, 'get_gemini_response', get_gemini_response)
+    _, lines = post_batch(client, [{'places': ['Slow']}, {'places': ['Fast']}])
+    assert [line['index'] for line in lines] == [1, 0]
+
+
+def test_batch_reports_per_trip_errors(client, monkeypatch):
+    def get_gemini_response(prompt, location, task):
+        return "Error: quota exhausted" if 'Broken' in prompt else ITINERARY
+
+    monkeypatch.setattr(app_module, 'get_gemini_response', get_gemini_response)
+    _, lines = post_batch(client, [{'places': ['Goa']}, {'places': ['Broken']}])
+    results = {line['index']: line for line in lines}
+    assert results[0]['itineraryId']
+    assert results[1] == {'index': 1, 'error': 'Error: quota exhausted'}
+    # Generation ran, so the failed trip stays charged
+    assert itinerary_tokens() == pytest.approx(limiter.burst('itinerary') - 2, abs=0.1)
+
+
+def test_batch_refunds_trips_rejected_by_admission(client, monkeypatch):
+    def get_gemini_response(prompt, location, task):
+        if 'Busy' in prompt:
+            raise Overloaded("Gemini is at capacity, try again shortly", retry_after=20)
+        return ITINERARY
+
+    monkeypatch.setattr(app_module, 'get_gemini_response', get_gemini_response)
+    _, lines = post_batch(client, [{'places': ['Goa']}, {'places': ['Busy']}, {'places': ['Busy', 'Goa']}])
+    results = {line['index']: line for line in lines}
+    assert results[0]['itineraryId']
+    assert results[1] == {'index': 1, 'error': 'Gemini is at capacity, try again shortly', 'retryAfter': 20}
+    assert results[2]['retryAfter'] == 20
+    assert itinerary_tokens() == pytest.approx(limiter.burst('itinerary') - 1, abs=0.1)
+
+
+@pytest.mark.parametrize('body', [
+    {'trips': []},
+    {'trips': 'Goa'},
+    {'trips': [{'places': 'Goa'}]},
+    {'trips': [{'places': [None]}]},
+    {'trips': [{'places': ['  ']}]},
+    {'trips': [1]},
+])
+def test_batch_rejects_invalid_trips(client, body):
+    response = client.post('/api/itinerary/batch', json=body)
+    assert response.status_code == 400
+    assert ('ip:127.0.0.1', 'itinerary') not in limiter.local._buckets
+
+
+def test_batch_size_is_capped_by_the_itinerary_burst(client):
+    assert app_module.BATCH_MAX_TRIPS <= limiter.burst('itinerary')
+    response, _ = post_batch(client, [{'places': ['Goa']}] * (app_module.BATCH_MAX_TRIPS + 1))
+    assert response.status_code == 400
+
+
+def test_batch_draws_on_the_itinerary_quota(client):
+    client.post('/api/itinerary', json={'places': ['Goa'], 'returnText': True})
+    response, _ = post_batch(client, [{'places': ['Goa']}] * app_module.BATCH_MAX_TRIPS)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
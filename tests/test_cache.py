@@ -0,0 +1,251 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from utils.cache import MemoryBackend, NamespaceCache, RedisBackend, SQLiteBackend
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of the Redis protocol for RedisBackend: strings with NX/PX and sorted sets"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RespHandler)
+        self.strings = {}
+        self.zsets = {}
+        self.lock = threading.Lock()
+
+    def live(self, key):
+        entry = self.strings.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.time():
+            del self.strings[key]
+            entry = None
+        return entry
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            data = b'$-1\r\n'
+        elif isinstance(value, int):
+            data = b':%d\r\n' % value
+        elif isinstance(value, str):
+            data = f'+{value}\r\n'.encode()
+        elif isinstance(value, list):
+            data = b'*%d\r\n' % len(value) + b''.join(b'$%d\r\n%s\r\n' % (len(v), v) for v in value)
+        else:
+            data = b'$%d\r\n%s\r\n' % (len(value), value)
+        self.wfile.write(data)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name, args = args[0].decode().upper(), args[1:]
+            with server.lock:
+                if name in ('AUTH', 'SELECT', 'PING'):
+                    self.reply('OK')
+                elif name == 'GET':
+                    entry = server.live(args[0])
+                    self.reply(entry[0] if entry else None)
+                elif name == 'SET':
+                    key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+                    if 'NX' in options and server.live(key):
+                        self.reply(None)
+                        continue
+                    expires_at = None
+                    if 'PX' in options:
+                        expires_at = time.time() + int(options[options.index('PX') + 1]) / 1000
+                    server.strings[key] = (value, expires_at)
+                    self.reply('OK')
+                elif name == 'DEL':
+                    self.reply(sum(server.strings.pop(key, None) is not None for key in args))
+                elif name == 'ZADD':
+                    server.zsets.setdefault(args[0], {})[args[2]] = float(args[1])
+                    self.reply(1)
+                elif name == 'ZCARD':
+                    self.reply(len(server.zsets.get(args[0], {})))
+                elif name == 'ZRANGE':
+                    members = sorted(server.zsets.get(args[0], {}).items(), key=lambda item: (item[1], item[0]))
+                    self.reply([member for member, _ in members[int(args[1]):int(args[2]) + 1]])
+                elif name == 'ZREM':
+                    zset = server.zsets.get(args[0], {})
+                    self.reply(sum(zset.pop(member, None) is not None for member in args[1:]))
+                else:
+                    self.wfile.write(f'-ERR unknown command {name}\r\n'.encode())
+
+
+@pytest.fixture(scope='module')
+def resp_server():
+    server = RespStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'cache.sqlite3'))
+    server = request.getfixturevalue('resp_server')
+    with server.lock:
+        server.strings.clear()
+        server.zsets.clear()
+    return RedisBackend(f"redis://127.0.0.1:{server.server_address[1]}/1")
+
+
+def test_get_set_round_trip(backend):
+    value = {'text': 'Día 1', 'coords': [15.29, 74.12], 'sections': [{'title': 'Tips', 'days': 3}], 'none': None}
+    assert backend.get('ns', 'missing') == (False, None)
+    backend.set('ns', 'key', value)
+    assert backend.get('ns', 'key') == (True, value)
+    assert backend.get('other', 'key') == (False, None)
+
+
+def test_bytes_round_trip(backend):
+    backend.set('ns', 'png', b'\x89PNG\r\n\x1a\n\x00\xff')
+    assert backend.get('ns', 'png') == (True, b'\x89PNG\r\n\x1a\n\x00\xff')
+
+
+def test_set_overwrites_and_delete(backend):
+    backend.set('ns', 'key', 1)
+    backend.set('ns', 'key', 2)
+    assert backend.get('ns', 'key') == (True, 2)
+    backend.delete('ns', 'key')
+    assert backend.get('ns', 'key') == (False, None)
+
+
+def test_add_only_when_absent(backend):
+    assert backend.add('ns', 'lock', 1, ttl=10)
+    assert not backend.add('ns', 'lock', 2, ttl=10)
+    assert backend.get('ns', 'lock') == (True, 1)
+    backend.delete('ns', 'lock')
+    assert backend.add('ns', 'lock', 3, ttl=10)
+
+
+def test_ttl_expiry(backend):
+    backend.set('ns', 'short', 'value', ttl=0.05)
+    backend.set('ns', 'long', 'value', ttl=60)
+    assert backend.get('ns', 'short') == (True, 'value')
+    time.sleep(0.1)
+    assert backend.get('ns', 'short') == (False, None)
+    assert backend.get('ns', 'long') == (True, 'value')
+
+
+def test_add_replaces_expired_entry(backend):
+    assert backend.add('ns', 'lock', 1, ttl=0.05)
+    time.sleep(0.1)
+    assert backend.add('ns', 'lock', 2, ttl=10)
+    assert backend.get('ns', 'lock') == (True, 2)
+
+
+def test_max_entries_evicts_oldest(backend):
+    for i in range(5):
+        backend.set('ns', f'key{i}', i, max_entries=3)
+        time.sleep(0.002)
+    assert [backend.get('ns', f'key{i}')[0] for i in range(5)] == [False, False, True, True, True]
+
+
+def test_get_or_set_loads_once_per_key(backend):
+    cache = NamespaceCache(backend, 'ns')
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'coords': [1.5, 2.5]}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_set('goa', loader))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'coords': [1.5, 2.5]}] * 5
+    assert cache.get('goa') == {'coords': [1.5, 2.5]}
+
+
+def test_get_or_set_does_not_serialize_other_keys(backend):
+    cache = NamespaceCache(backend, 'ns')
+
+    def slow():
+        time.sleep(0.5)
+        return 'slow'
+
+    thread = threading.Thread(target=cache.get_or_set, args=('slow', slow))
+    thread.start()
+    time.sleep(0.05)
+    start = time.time()
+    assert cache.get_or_set('fast', lambda: 'fast') == 'fast'
+    assert time.time() - start < 0.25
+    thread.join()
+
+
+def test_lock_is_exclusive(backend):
+    cache = NamespaceCache(backend, 'ns')
+    with cache.lock('itinerary'):
+        with pytest.raises(TimeoutError):
+            with cache.lock('itinerary', wait=0.2):
+                pass
+    with cache.lock('itinerary', wait=0.2):
+        pass
+
+
+def test_waiters_load_once_the_holder_stores_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr('utils.cache.LOCK_WAIT_SECONDS', 5)
+    path = str(tmp_path / 'cache.sqlite3')
+    first = NamespaceCache(SQLiteBackend(path), 'ns')
+    second = NamespaceCache(SQLiteBackend(path), 'ns')
+
+    def failing():
+        time.sleep(0.3)
+        raise RuntimeError('upstream down')
+
+    def run_first():
+        with pytest.raises(RuntimeError):
+            first.get_or_set('key', failing)
+
+    thread = threading.Thread(target=run_first)
+    thread.start()
+    time.sleep(0.1)
+    start = time.time()
+    assert second.get_or_set('key', lambda: 'loaded') == 'loaded'
+    assert time.time() - start < 1
+    thread.join()
+
+
+def test_none_ttl_caches_misses_briefly(backend):
+    cache = NamespaceCache(backend, 'ns')
+    calls = []
+
+    def missing():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_set('nowhere', missing, none_ttl=0.1) is None
+    assert cache.get_or_set('nowhere', missing, none_ttl=0.1) is None
+    assert len(calls) == 1
+    time.sleep(0.15)
+    cache.get_or_set('nowhere', missing, none_ttl=0.1)
+    assert len(calls) == 2
@@ -0,0 +1,103 @@
+import pytest
+
+from utils import itinerary
+from utils.itinerary import (
+    prepare_itinerary_document, replace_itinerary_section, split_itinerary_sections, strip_reply_preamble
+)
+
+
+def titles(markdown_text):
+    return [section['title'] for section in split_itinerary_sections(markdown_text)]
+
+
+HEADING_ITINERARY = """# Goa Getaway
+A short intro.
+
+## Day 1: Arrival
+### Morning
+Check in.
+
+## Day 2: Beaches
+Swim.
+
+## Tips
+* Sunscreen"""
+
+BOLD_ITINERARY = """Here is your itinerary!
+
+**Day 1: Arrival**
+**Morning:**
+* Check in
+
+**Afternoon:**
+* Baga beach
+
+**Day 2: Forts**
+**Morning:**
+* Aguada fort
+
+**Evening:**
+* Sunset cruise
+
+**Tips:**
+* Sunscreen"""
+
+
+def test_heading_days_and_siblings():
+    assert titles(HEADING_ITINERARY) == ['Goa Getaway', 'Day 1: Arrival', 'Day 2: Beaches', 'Tips']
+
+
+def test_bold_days_keep_time_of_day_labels_inside():
+    assert titles(BOLD_ITINERARY) == ['Here is your itinerary!', 'Day 1: Arrival', 'Day 2: Forts', 'Tips:']
+
+
+def test_single_bold_day_is_one_section():
+    assert titles("**Day 1**\n\n**Morning:**\nA\n\n**Afternoon:**\nB") == ['Day 1']
+
+
+def test_no_day_headings_split_on_top_level():
+    assert titles("# Plan\nIntro\n## Food\nx\n## Stay\ny") == ['Plan']
+    assert titles("## Food\nx\n### Street food\nz\n## Stay\ny") == ['Food', 'Stay']
+
+
+def test_plain_text_is_one_section():
+    assert titles("Just a paragraph\nwith two lines") == ['Just a paragraph']
+
+
+def test_sections_round_trip_to_the_original_text():
+    for text in (HEADING_ITINERARY, BOLD_ITINERARY):
+        assert '\n'.join(section['markdown'] for section in split_itinerary_sections(text)) == text
+
+
+def test_replace_reconverts_only_that_section(monkeypatch):
+    document = prepare_itinerary_document(BOLD_ITINERARY)
+    converted = []
+    original = itinerary.markdown_to_latex
+    monkeypatch.setattr(itinerary, 'markdown_to_latex', lambda text: converted.append(text) or original(text))
+
+    updated = replace_itinerary_section(document, 2, "**Day 2: Palaces**\n**Evening:**\n* Palace tour\n")
+
+    assert converted == ["**Day 2: Palaces**\n**Evening:**\n* Palace tour\n"]
+    assert [section['title'] for section in updated['sections']] == [
+        'Here is your itinerary!', 'Day 1: Arrival', 'Day 2: Palaces', 'Tips:'
+    ]
+    assert updated['sections'][3] is document['sections'][3]
+    assert 'Palace tour' in updated['latex_content']
+    assert document['sections'][2]['title'] == 'Day 2: Forts'
+
+
+@pytest.mark.parametrize('reply', [
+    "**Day 2: Palaces**\n* Palace tour\n\n**Tips:**\n* Hat\n",
+    "Sure, here you go!\n\n**Day 2: Palaces**\n* Palace tour\n",
+    "**Day 2: Palaces**\n* Palace\n\n**Day 3: Markets**\n* Market\n",
+])
+def test_replace_rejects_replies_that_change_other_sections(reply):
+    document = prepare_itinerary_document(BOLD_ITINERARY)
+    with pytest.raises(ValueError):
+        replace_itinerary_section(document, 2, reply)
+
+
+def test_strip_reply_preamble():
+    assert strip_reply_preamble("Sure! Here's a fresh take:\n\n## Day 2\nx") == "## Day 2\nx"
+    assert strip_reply_preamble("**Day 2: Forts**\nx") == "**Day 2: Forts**\nx"
+    assert strip_reply_preamble("No heading here") == "No heading here"
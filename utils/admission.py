@@ -0,0 +1,326 @@
+import base64
+import contextvars
+import functools
+import hashlib
+import hmac
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from flask import jsonify, request
+
+from .cache import get_cache
+
+# Lower number = served first when a gate is saturated
+PRIORITY_INTERACTIVE = 0
+PRIORITY_STANDARD = 1
+PRIORITY_BULK = 2
+
+# Token buckets as "capacity/seconds": a client may burst `capacity` requests,
+# refilled evenly over `seconds`. Override with e.g. RATE_LIMIT_CHAT=30/60.
+# With a shared cache backend (sqlite/redis) the buckets are shared by every
+# worker; with CACHE_BACKEND=memory each worker process has its own.
+DEFAULT_RATE_LIMITS = {
+    'user': '120/60',
+    'chat': '20/60',
+    'destination': '30/60',
+    'itinerary': '6/300',
+    'batch': '2/300',
+    'download': '30/60',
+    'stats': '30/60',
+}
+
+# Shared secret for the operational stats endpoints; they are hidden when unset
+STATS_TOKEN = os.getenv('STATS_TOKEN', '')
+
+BUCKET_IDLE_SECONDS = 15 * 60
+BUCKET_LOCK_WAIT_SECONDS = 1
+
+_priority = contextvars.ContextVar('admission_priority', default=PRIORITY_STANDARD)
+
+class AdmissionRejected(Exception):
+    """Request refused by admission control; carries the HTTP status and Retry-After"""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class RateLimited(AdmissionRejected):
+    status_code = 429
+
+class Overloaded(AdmissionRejected):
+    status_code = 503
+
+def _parse_rate(value):
+    capacity, seconds = value.split('/')
+    capacity = float(capacity)
+    return capacity, capacity / float(seconds)
+
+def _load_rate_limits():
+    limits = {}
+    for name, default in DEFAULT_RATE_LIMITS.items():
+        limits[name] = _parse_rate(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+    return limits
+
+class TokenBucketLimiter:
+    """Token buckets keyed by (client, bucket name)"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now):
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated > BUCKET_IDLE_SECONDS]
+        for key in idle:
+            del self._buckets[key]
+
+    def burst(self, name):
+        """Most tokens a single call can take from the named bucket"""
+        return int(self.limits[name][0])
+
+    def consume(self, client, names, count=1):
+        """Take count tokens from each named bucket, or raise RateLimited without taking any"""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            refreshed = {}
+            for name in names:
+                refreshed[(client, name)] = _refill(name, self.limits[name], self._buckets.get((client, name)), now, count)
+            for key, tokens in refreshed.items():
+                self._buckets[key] = (tokens - count, now)
+
+    def refund(self, client, name, count=1):
+        """Give back tokens taken for work that was never done"""
+        now = time.monotonic()
+        with self._lock:
+            capacity, rate = self.limits[name]
+            tokens, updated = self._buckets.get((client, name), (capacity, now))
+            self._buckets[(client, name)] = (min(capacity, tokens + (now - updated) * rate + count), now)
+
+class SharedTokenBuckets:
+    """Token buckets kept in the shared cache, so every worker draws on one quota per client
+
+    Falls back to per-process buckets when the cache backend is per-process or unavailable.
+    """
+
+    def __init__(self, limits, cache):
+        self.limits = limits
+        self.cache = cache
+        self.local = TokenBucketLimiter(limits)
+
+    def burst(self, name):
+        return self.local.burst(name)
+
+    def consume(self, client, names, count=1):
+        """Take count tokens from each named bucket, or raise RateLimited without taking any"""
+        try:
+            if not self.cache.backend.shared:
+                return self.local.consume(client, names, count)
+            with ExitStack() as locks:
+                # A fixed lock order so requests touching overlapping buckets cannot deadlock
+                for name in sorted(set(names)):
+                    locks.enter_context(self.cache.lock(f"{client}:{name}", wait=BUCKET_LOCK_WAIT_SECONDS))
+                now = time.time()
+                refreshed = {}
+                for name in names:
+                    refreshed[name] = _refill(name, self.limits[name], self.cache.get(f"{client}:{name}"), now, count)
+                for name, tokens in refreshed.items():
+                    self.cache.set(f"{client}:{name}", [tokens - count, now])
+        except RateLimited:
+            raise
+        except Exception as e:
+            print(f"Shared rate limits unavailable, using per-worker buckets: {e}")
+            self.local.consume(client, names, count)
+
+    def refund(self, client, name, count=1):
+        """Give back tokens taken for work that was never done"""
+        try:
+            if not self.cache.backend.shared:
+                return self.local.refund(client, name, count)
+            with self.cache.lock(f"{client}:{name}", wait=BUCKET_LOCK_WAIT_SECONDS):
+                capacity, rate = self.limits[name]
+                now = time.time()
+                tokens, updated = self.cache.get(f"{client}:{name}") or (capacity, now)
+                self.cache.set(f"{client}:{name}", [min(capacity, tokens + max(0, now - updated) * rate + count), now])
+        except Exception as e:
+            print(f"Rate limit refund failed: {e}")
+
+def _refill(name, limit, state, now, count):
+    """Tokens in a bucket after refilling it up to now; raises RateLimited if fewer than count"""
+    capacity, rate = limit
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + max(0, now - updated) * rate)
+    if tokens < count:
+        raise RateLimited(f"Rate limit exceeded for {name}", retry_after=(count - tokens) / rate)
+    return tokens
+
+class PriorityGate:
+    """Concurrency cap whose waiters are admitted in priority order, then FIFO"""
+
+    def __init__(self, name, limit, max_queue, wait_timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self._active = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=None):
+        if priority is None:
+            priority = _priority.get()
+        with self._cond:
+            if self._active < self.limit and not self._waiting:
+                self._active += 1
+                return
+            if len(self._waiting) >= self.max_queue:
+                raise Overloaded(f"{self.name} is at capacity, try again shortly", retry_after=self.wait_timeout)
+
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiting, ticket)
+            deadline = time.monotonic() + self.wait_timeout
+            while True:
+                if self._active < self.limit and self._waiting[0] == ticket:
+                    heapq.heappop(self._waiting)
+                    self._active += 1
+                    self._cond.notify_all()
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise Overloaded(f"Timed out waiting for {self.name}", retry_after=self.wait_timeout)
+                self._cond.wait(remaining)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=None):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'active': self._active, 'queued': len(self._waiting)}
+
+limiter = SharedTokenBuckets(
+    _load_rate_limits(),
+    get_cache('ratelimits', ttl=BUCKET_IDLE_SECONDS, max_entries=50000)
+)
+
+# Concurrency gates are per worker process: with N workers, up to N x limit calls
+# run at once. Size GEMINI_MAX_CONCURRENCY and RENDER_MAX_CONCURRENCY per worker.
+
+gemini_gate = PriorityGate(
+    'Gemini',
+    limit=int(os.getenv('GEMINI_MAX_CONCURRENCY', 8)),
+    max_queue=int(os.getenv('GEMINI_MAX_QUEUE', 32)),
+    wait_timeout=float(os.getenv('GEMINI_QUEUE_TIMEOUT', 20)),
+)
+
+render_gate = PriorityGate(
+    'PDF rendering',
+    limit=int(os.getenv('RENDER_MAX_CONCURRENCY', 2)),
+    max_queue=int(os.getenv('RENDER_MAX_QUEUE', 16)),
+    wait_timeout=float(os.getenv('RENDER_QUEUE_TIMEOUT', 30)),
+)
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+def _user_id_from_token(token):
+    """Return the userId of an HS256 JWT signed with JWT_SECRET, or None"""
+    secret = os.getenv('JWT_SECRET')
+    if not secret:
+        return None
+    try:
+        header, payload, signature = token.split('.')
+        expected = hmac.new(secret.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+        if claims.get('exp') and claims['exp'] < time.time():
+            return None
+        return claims.get('userId')
+    except (ValueError, TypeError):
+        return None
+
+def client_key():
+    """Rate-limit key: the authenticated user, or the client IP for anonymous traffic
+
+    The IP is the peer address; behind a proxy, set TRUSTED_PROXY_HOPS so
+    ProxyFix resolves it from X-Forwarded-For.
+    """
+    token = (request.headers.get('Authorization') or '').replace('Bearer ', '').strip()
+    if token:
+        user_id = _user_id_from_token(token)
+        if user_id:
+            return f"user:{user_id}"
+    return f"ip:{request.remote_addr}"
+
+def admission_control(bucket, priority=PRIORITY_STANDARD):
+    """Apply per-client token buckets to a route and tag its downstream work with a priority"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter.consume(client_key(), ['user', bucket])
+            token = _priority.set(priority)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _priority.reset(token)
+        return wrapper
+    return decorator
+
+def charge(bucket, count):
+    """Take count tokens from one of the current client's buckets, e.g. per item of a batch
+
+    Returns a refund(count=1) callable, usable from worker threads, for items
+    that end up not being served.
+    """
+    client = client_key()
+    limiter.consume(client, [bucket], count)
+    return functools.partial(limiter.refund, client, bucket)
+
+def require_stats_token(view):
+    """Restrict a route to callers sending the configured STATS_TOKEN as X-Stats-Token"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get('X-Stats-Token', '')
+        if not STATS_TOKEN or not hmac.compare_digest(token.encode(), STATS_TOKEN.encode()):
+            return jsonify({"error": "Not found"}), 404
+        return view(*args, **kwargs)
+    return wrapper
+
+def run_with_priority(priority, fn, *args, **kwargs):
+    """Run fn with downstream gate priority set, e.g. from a worker thread"""
+    token = _priority.set(priority)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _priority.reset(token)
+
+def admission_stats():
+    """Gate occupancy for this worker process only"""
+    return {'pid': os.getpid(), 'gemini': gemini_gate.stats(), 'render': render_gate.stats()}
@@ -0,0 +1,506 @@
+import base64
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# CACHE_BACKEND selects where cached values live:
+#   memory - per-process LRU (lost on restart, duplicated per worker)
+#   sqlite - a shared SQLite file on local disk (default; shared by all workers on the host)
+#   redis  - any Redis-protocol server given by CACHE_URL, e.g. redis://localhost:6379/0
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+CACHE_URL = os.getenv('CACHE_URL', '')
+
+def user_temp_path(name):
+    """A per-user path in the system temp directory, e.g. /tmp/bagpack-cache-1000"""
+    return os.path.join(tempfile.gettempdir(), f"{name}-{getattr(os, 'getuid', lambda: 'app')()}")
+
+# Private per-user directory for the SQLite file; never a shared, world-writable path
+CACHE_DIR = os.getenv('CACHE_DIR', user_temp_path('bagpack-cache'))
+
+LOCK_TTL_SECONDS = 60
+LOCK_WAIT_SECONDS = float(os.getenv('CACHE_LOCK_WAIT_SECONDS', 30))
+LOCK_POLL_SECONDS = 0.1
+
+def _encode_value(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Cannot cache values of type {type(value).__name__}")
+
+def _decode_value(obj):
+    if len(obj) == 1 and '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+def dumps(value):
+    """Serialize a cache value as JSON (bytes allowed), so reading a shared cache never runs code"""
+    return json.dumps(value, default=_encode_value, separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    return json.loads(data, object_hook=_decode_value)
+
+def private_directory(path):
+    """Create path for this user only, refusing a directory someone else owns or can write to"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o022):
+        raise PermissionError(f"Cache directory {path} is not private to this user")
+    return path
+
+class MemoryBackend:
+    """In-process LRU, one OrderedDict per namespace"""
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        now = time.time()
+        with self._lock:
+            entries = self._data.get(namespace)
+            if not entries or key not in entries:
+                return False, None
+            expires_at, value = entries[key]
+            if expires_at is not None and expires_at <= now:
+                del entries[key]
+                return False, None
+            entries.move_to_end(key)
+            return True, value
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            entries = self._data.setdefault(namespace, OrderedDict())
+            entries[key] = (expires_at, value)
+            entries.move_to_end(key)
+            if max_entries:
+                while len(entries) > max_entries:
+                    entries.popitem(last=False)
+
+    def add(self, namespace, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            entries = self._data.setdefault(namespace, OrderedDict())
+            if key in entries:
+                expires_at, _ = entries[key]
+                if expires_at is None or expires_at > now:
+                    return False
+            entries[key] = (now + ttl if ttl else None, value)
+            return True
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+
+class SQLiteBackend:
+    """Shared on-disk cache: one SQLite file (WAL + mmap) used by every worker on the host"""
+
+    shared = True
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(private_directory(CACHE_DIR), 'cache.sqlite3')
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB,"
+                " expires_at REAL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)")
+
+    def _connection(self):
+        # Connections must not cross threads or survive a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            return False, None
+        value, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            return False, None
+        # Refresh recency at most once a minute to keep reads cheap
+        if now - accessed_at > 60:
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key)
+            )
+        return True, loads(value)
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, sqlite3.Binary(dumps(value)),
+             now + ttl if ttl else None, now)
+        )
+        if max_entries:
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, max_entries)
+            )
+
+    def add(self, namespace, key, value, ttl=None):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ? AND expires_at <= ?",
+            (namespace, key, now)
+        )
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, sqlite3.Binary(dumps(value)), now + ttl if ttl else None, now)
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, namespace, key):
+        self._connection().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+class RedisError(Exception):
+    pass
+
+class RedisBackend:
+    """Cache on any server speaking the Redis protocol (RESP), using a minimal built-in client
+
+    Size caps are enforced with a per-namespace sorted set of keys by write time.
+    """
+
+    shared = True
+
+    def __init__(self, url=None):
+        parsed = urlparse(url or 'redis://localhost:6379/0')
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.prefix = 'bagpack'
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=5)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        self._local.pid = os.getpid()
+        if self.password:
+            self._command('AUTH', self.password)
+        if self.db:
+            self._command('SELECT', self.db)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _command(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        self._local.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def execute(self, *args):
+        if getattr(self._local, 'sock', None) is None or self._local.pid != os.getpid():
+            self._connect()
+        try:
+            return self._command(*args)
+        except (ConnectionError, socket.error):
+            # One reconnect for connections dropped while idle
+            self._connect()
+            return self._command(*args)
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace, key):
+        value = self.execute('GET', self._key(namespace, key))
+        if value is None:
+            return False, None
+        return True, loads(value)
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        full_key = self._key(namespace, key)
+        data = dumps(value)
+        if ttl:
+            self.execute('SET', full_key, data, 'PX', int(ttl * 1000))
+        else:
+            self.execute('SET', full_key, data)
+        if max_entries:
+            index = f"{self.prefix}:{namespace}:__index__"
+            self.execute('ZADD', index, time.time(), full_key)
+            overflow = self.execute('ZCARD', index) - max_entries
+            if overflow > 0:
+                evicted = self.execute('ZRANGE', index, 0, overflow - 1)
+                if evicted:
+                    self.execute('ZREM', index, *evicted)
+                    self.execute('DEL', *evicted)
+
+    def add(self, namespace, key, value, ttl=None):
+        args = ['SET', self._key(namespace, key), dumps(value), 'NX']
+        if ttl:
+            args += ['PX', int(ttl * 1000)]
+        return self.execute(*args) == 'OK'
+
+    def delete(self, namespace, key):
+        self.execute('DEL', self._key(namespace, key))
+
+def create_backend(name=None, url=None):
+    name = (name or CACHE_BACKEND).lower()
+    url = url if url is not None else CACHE_URL
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'redis':
+        return RedisBackend(url or None)
+    return SQLiteBackend(url or None)
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers for that key share its outcome"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        """Return (result, shared); shared is True for callers that waited on another's call"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class NamespaceCache:
+    """Cache namespace with its own TTL, size cap, stampede protection and statistics"""
+
+    def __init__(self, backend, namespace, ttl=None, max_entries=None):
+        self._backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight = SingleFlight()
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'coalesced': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        # Resolved on first use so importing a module that declares a cache opens nothing
+        if self._backend is None:
+            self._backend = get_backend()
+        return self._backend
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def make_key(key):
+        if isinstance(key, str) and len(key) <= 200:
+            return key
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _lookup(self, key):
+        try:
+            return self.backend.get(self.namespace, key)
+        except Exception as e:
+            self._count('errors')
+            print(f"Cache read failed ({self.namespace}): {e}")
+            return False, None
+
+    def get(self, key, default=None):
+        found, value = self._lookup(self.make_key(key))
+        self._count('hits' if found else 'misses')
+        return value if found else default
+
+    def set(self, key, value, ttl=None):
+        """Store a value; returns False (after logging) if the backend write failed"""
+        try:
+            self.backend.set(self.namespace, self.make_key(key), value, ttl or self.ttl, self.max_entries)
+            return True
+        except Exception as e:
+            self._count('errors')
+            print(f"Cache write failed ({self.namespace}): {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            self.backend.delete(self.namespace, self.make_key(key))
+        except Exception as e:
+            self._count('errors')
+            print(f"Cache delete failed ({self.namespace}): {e}")
+
+    @contextmanager
+    def lock(self, key, wait=LOCK_WAIT_SECONDS):
+        """Hold a lock on key across every process sharing the backend, for read-modify-write updates"""
+        lock_key = f"__mutex__:{self.make_key(key)}"
+        deadline = time.time() + wait
+        while not self.backend.add(self.namespace, lock_key, os.getpid(), LOCK_TTL_SECONDS):
+            if time.time() >= deadline:
+                raise TimeoutError(f"Timed out waiting for {self.namespace} lock")
+            time.sleep(LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            try:
+                self.backend.delete(self.namespace, lock_key)
+            except Exception as e:
+                print(f"Cache unlock failed ({self.namespace}): {e}")
+
+    def get_or_set(self, key, loader, ttl=None, cache_none=False, none_ttl=None):
+        """Return the cached value or load it once, even when many callers miss at the same time
+
+        A None result is not cached unless cache_none is set; none_ttl caches it
+        briefly instead, so repeated misses for the same key are not reloaded at once.
+        """
+        cache_key = self.make_key(key)
+        found, value = self._lookup(cache_key)
+        if found:
+            self._count('hits')
+            return value
+        self._count('misses')
+
+        # One loader per key within this process; concurrent callers share its result
+        value, shared = self._inflight.run(
+            cache_key, lambda: self._load(key, cache_key, loader, ttl, cache_none, none_ttl)
+        )
+        if shared:
+            self._count('coalesced')
+        return value
+
+    def _load(self, key, cache_key, loader, ttl, cache_none, none_ttl):
+        found, value = self._lookup(cache_key)
+        if found:
+            self._count('coalesced')
+            return value
+
+        # For shared backends, one loader per key across processes too
+        lock_key = f"__lock__:{cache_key}"
+        holds_lock = True
+        if self.backend.shared:
+            try:
+                holds_lock = self.backend.add(self.namespace, lock_key, os.getpid(), LOCK_TTL_SECONDS)
+            except Exception:
+                holds_lock = False
+            # Wait for the holder's value; if it stores nothing (a None result or an
+            # error) the lock is released and the next waiter to take it loads instead
+            deadline = time.time() + LOCK_WAIT_SECONDS
+            while not holds_lock and time.time() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                found, value = self._lookup(cache_key)
+                if found:
+                    self._count('coalesced')
+                    return value
+                try:
+                    holds_lock = self.backend.add(self.namespace, lock_key, os.getpid(), LOCK_TTL_SECONDS)
+                except Exception:
+                    break
+
+        try:
+            self._count('loads')
+            value = loader()
+            if value is not None or cache_none:
+                self.set(key, value, ttl)
+            elif none_ttl:
+                self.set(key, None, none_ttl)
+            return value
+        finally:
+            if self.backend.shared and holds_lock:
+                try:
+                    self.backend.delete(self.namespace, lock_key)
+                except Exception:
+                    pass
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        return stats
+
+_backend = None
+_namespaces = {}
+_registry_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _registry_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+def get_cache(namespace, ttl=None, max_entries=None):
+    """Return the shared NamespaceCache for a namespace, creating it on first use"""
+    with _registry_lock:
+        if namespace not in _namespaces:
+            _namespaces[namespace] = NamespaceCache(None, namespace, ttl=ttl, max_entries=max_entries)
+        return _namespaces[namespace]
+
+def cache_stats():
+    """Per-namespace statistics for this process"""
+    with _registry_lock:
+        namespaces = dict(_namespaces)
+    return {
+        'backend': type(_backend).__name__ if _backend else None,
+        'namespaces': {name: cache.stats() for name, cache in namespaces.items()},
+    }
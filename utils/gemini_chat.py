@@ -1,35 +1,104 @@
 # --- utils/gemini_chat.py ---
 import os
-import google.generativeai as genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dotenv import load_dotenv
+from .admission import AdmissionRejected, gemini_gate
+from .cache import get_cache
+from .model_router import ModelRouter
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Configure with API key, not application default credentials
-genai.configure(api_key=GEMINI_API_KEY)
+router = ModelRouter()
 
-# Use the correct model name for Gemini
-model = genai.GenerativeModel("gemini-2.0-flash")
+# Runs tier calls that may be abandoned at the task's latency budget; the SDK
+# version pinned here has no per-request timeout of its own
+_tier_calls = ThreadPoolExecutor(max_workers=gemini_gate.limit * 2, thread_name_prefix='gemini-tier')
 
-def get_gemini_response(message, location=None):
+_suggestions = get_cache('suggestions', ttl=24 * 60 * 60, max_entries=2000)
+
+_models = {}
+_models_lock = threading.Lock()
+_configured = False
+
+def get_model(model_name):
+    """Configure the SDK and build GenerativeModel instances on first use"""
+    global _configured
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    with _models_lock:
+        # The SDK import is heavy, so it happens here rather than at module import
+        import google.generativeai as genai
+        if not _configured:
+            # Configure with API key, not application default credentials
+            genai.configure(api_key=GEMINI_API_KEY)
+            _configured = True
+        if model_name not in _models:
+            _models[model_name] = genai.GenerativeModel(model_name)
+        return _models[model_name]
+
+def generate_content(prompt, task="chat"):
+    """Generate text with the routed model for this task, falling back through faster tiers on failure
+
+    Every tier but the last is abandoned once the task's latency budget runs out.
+    """
+    last_error = None
+    candidates = router.candidates(task)
+    budget = router.latency_budget(task)
+    with gemini_gate.slot():
+        for i, model_name in enumerate(candidates):
+            start = time.monotonic()
+            try:
+                if i < len(candidates) - 1:
+                    call = _tier_calls.submit(get_model(model_name).generate_content, prompt)
+                    try:
+                        response = call.result(timeout=budget)
+                    except FutureTimeout:
+                        raise TimeoutError(f"no response within the {budget:g}s latency budget") from None
+                else:
+                    # The last tier runs without a budget so the call can still succeed
+                    response = get_model(model_name).generate_content(prompt)
+                text = response.text.strip()
+            except Exception as e:
+                router.record(task, model_name, time.monotonic() - start, ok=False)
+                print(f"Gemini API Error ({task} via {model_name}): {str(e)}")
+                last_error = e
+                continue
+            latency = time.monotonic() - start
+            router.record(task, model_name, latency, ok=True)
+            print(f"Gemini {task} call served by {model_name} in {latency:.2f}s")
+            return text
+    raise last_error or RuntimeError(f"No Gemini model configured for {task}")
+
+def get_model_stats():
+    return router.stats()
+
+def get_gemini_response(message, location=None, task="chat"):
     if not GEMINI_API_KEY:
         return "Error: GEMINI_API_KEY not found in environment variables"
     
     prompt = f"You are a travel assistant for India. Location: {location or 'unspecified'}.\nUser: {message}\nGive detailed and friendly travel suggestions."
     
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return generate_content(prompt, task=task)
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Gemini API Error: {str(e)}")
         return f"Error: {str(e)}"
 
 def get_place_suggestions(destination):
-    """Get AI-generated place suggestions for a destination"""
+    """Get AI-generated place suggestions for a destination, cached per destination"""
     if not GEMINI_API_KEY:
         return None
+    return _suggestions.get_or_set(('destination', destination.strip().lower()), lambda: fetch_place_suggestions(destination))
+
+def fetch_place_suggestions(destination):
+    """Get AI-generated place suggestions for a destination"""
     
     prompt = f"""
     You are a travel expert. Generate exactly 8-10 tourist attractions for {destination}, India.
@@ -45,8 +114,9 @@ def get_place_suggestions(destination):
     """
     
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return generate_content(prompt, task="suggestions")
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Gemini API Error for suggestions: {str(e)}")
         return None
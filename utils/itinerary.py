@@ -3,11 +3,120 @@ import tempfile
 import os
 import io
 import re
+import shutil
+import hashlib
+import time
 from datetime import datetime, timedelta
-from PIL import Image as PILImage
-import requests
+from .cache import get_cache, private_directory, user_temp_path
 
-def fetch_static_map(places, width=600, height=350):
+MAP_CACHE_DIR = os.getenv('MAP_CACHE_DIR', user_temp_path('bagpack-maps'))
+MAP_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+MAX_CACHED_MAPS = int(os.getenv('MAX_CACHED_MAPS', 500))
+# The map is embedded at 0.8\textwidth; the widest template text block is 17cm
+MAP_PRINT_WIDTH_INCHES = 0.8 * 17 / 2.54
+MAP_PRINT_DPI = int(os.getenv('MAP_PRINT_DPI', 150))
+
+_maps = get_cache('maps', ttl=MAP_CACHE_TTL_SECONDS, max_entries=MAX_CACHED_MAPS)
+_last_map_sweep = 0
+
+def _map_cache_key(places, width, height):
+    """Key on rounded coordinates, marker order/colour and image size"""
+    markers = tuple(
+        (round(place["coords"][0], 4), round(place["coords"][1], 4), "red" if i == 0 else "blue")
+        for i, place in enumerate(places)
+        if place.get("coords") and None not in place["coords"][:2]
+    )
+    return hashlib.sha1(repr((markers, width, height)).encode('utf-8')).hexdigest()
+
+def optimize_map_image(image_data):
+    """Resample to print resolution, palette-quantize and strip metadata for LaTeX embedding"""
+    try:
+        # Imported on first use to keep worker start-up light
+        from PIL import Image as PILImage
+        with PILImage.open(io.BytesIO(image_data)) as image:
+            image = image.convert('RGB')
+            target_width = int(MAP_PRINT_WIDTH_INCHES * MAP_PRINT_DPI)
+            # Only ever downsample; upscaling adds bytes without detail
+            if image.width > target_width:
+                target_height = round(image.height * target_width / image.width)
+                image = image.resize((target_width, target_height), PILImage.LANCZOS)
+            image = image.quantize(colors=256, method=PILImage.Quantize.FASTOCTREE)
+            output = io.BytesIO()
+            # A fresh save carries no EXIF/text chunks from the source
+            image.save(output, format='PNG', optimize=True, dpi=(MAP_PRINT_DPI, MAP_PRINT_DPI))
+            return output.getvalue()
+    except Exception as e:
+        print(f"Map optimization failed, using original image: {e}")
+        return image_data
+
+def get_map_image_path(places, width=600, height=350):
+    """Return the path of the cached, optimized map PNG for these places, or None if no map is available"""
+    # Checked before trusting any existing file, since map names are predictable
+    private_directory(MAP_CACHE_DIR)
+    key = _map_cache_key(places, width, height)
+    path = os.path.join(MAP_CACHE_DIR, f"{key}.png")
+    
+    for _ in range(2):
+        if os.path.exists(path):
+            return path
+        # The PNG is stored once, as the file; the cache entry only records that it was
+        # written (or briefly, that no map service had one) and makes concurrent callers
+        # in any worker wait for a single download
+        written = _maps.get_or_set(key, lambda: _download_map_file(places, width, height, path), none_ttl=5 * 60)
+        if not written:
+            return None
+        if os.path.exists(path):
+            _sweep_map_cache()
+            return path
+        # Swept since it was recorded; forget the record and fetch it again
+        _maps.delete(key)
+    return None
+
+def _download_map_file(places, width, height, path):
+    map_data = download_static_map(places, width, height)
+    if not map_data:
+        return None
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=MAP_CACHE_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(optimize_map_image(map_data))
+    os.replace(temp_path, path)
+    return os.path.basename(path)
+
+def _sweep_map_cache():
+    """Drop map files past their TTL and the oldest ones beyond the cap"""
+    global _last_map_sweep
+    now = time.time()
+    if now - _last_map_sweep < 60:
+        return
+    _last_map_sweep = now
+    try:
+        names = os.listdir(MAP_CACHE_DIR)
+    except OSError:
+        return
+    files = []
+    for name in names:
+        path = os.path.join(MAP_CACHE_DIR, name)
+        try:
+            files.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    files.sort(reverse=True)
+    for i, (mtime, path) in enumerate(files):
+        if i >= MAX_CACHED_MAPS or mtime < now - MAP_CACHE_TTL_SECONDS:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def link_into(source_path, dest_path):
+    """Hard-link a cached file into a working directory, copying across filesystems"""
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        shutil.copyfile(source_path, dest_path)
+
+def download_static_map(places, width=600, height=350):
+    import requests
     marker_strs = []
     for i, place in enumerate(places):
         lat, lon = place.get("coords", [None, None])
@@ -105,6 +214,104 @@ def handle_bold_text(text):
     
     return text
 
+DAY_HEADING_PATTERN = re.compile(r'^(#{1,6}\s*)?(\*\*)?\s*day\s*\d+', re.IGNORECASE)
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+')
+BOLD_HEADING_PATTERN = re.compile(r'^\*\*([^*]+)\*\*:?$')
+# Closing blocks Gemini appends after the days, e.g. "**Tips:**" or "**Budget Breakdown**"
+TRAILER_LABEL_PATTERN = re.compile(
+    r'\b(tips?|budget|costs?|packing|notes?|summary|essentials|checklist|before you go|emergency|useful)\b',
+    re.IGNORECASE
+)
+
+def split_itinerary_sections(markdown_text):
+    """Split itinerary markdown into addressable sections, one per day (or per top-level heading)"""
+    return [build_itinerary_section(text) for text in _section_texts(markdown_text)]
+
+def _section_texts(markdown_text):
+    """The markdown of each section, without converting it"""
+    lines = markdown_text.split('\n')
+    
+    headings = []
+    for i, line in enumerate(lines):
+        match = HEADING_PATTERN.match(line.strip())
+        if match:
+            headings.append((i, len(match.group(1))))
+    
+    # Prefer day headings (plus sibling headings such as "Tips"); otherwise
+    # split on the shallowest heading level present
+    day_lines = [i for i, line in enumerate(lines) if DAY_HEADING_PATTERN.match(line.strip())]
+    day_levels = [level for i, level in headings if i in day_lines]
+    if day_lines:
+        split_level = max(day_levels) if day_levels else 0
+        boundaries = set(day_lines) | {i for i, level in headings if level <= split_level}
+        if split_level == 0:
+            boundaries |= _bold_sibling_lines(lines, day_lines)
+        boundaries = sorted(boundaries)
+    elif headings:
+        top_level = min(level for _, level in headings)
+        boundaries = [i for i, level in headings if level == top_level]
+    else:
+        boundaries = []
+    
+    if not boundaries or boundaries[0] != 0:
+        boundaries = [0] + boundaries
+    
+    return ['\n'.join(lines[start:end]) for start, end in zip(boundaries, boundaries[1:] + [len(lines)])]
+
+def _bold_sibling_lines(lines, day_lines):
+    """Bold-only trailer lines such as "**Tips:**" after the last bold day heading
+    
+    Other bold lines ("**Morning:**", "**Evening:**") are sub-headings within a day.
+    """
+    siblings = set()
+    for i in range(max(day_lines) + 1, len(lines)):
+        match = BOLD_HEADING_PATTERN.match(lines[i].strip())
+        if match and not lines[i - 1].strip() and TRAILER_LABEL_PATTERN.search(match.group(1)):
+            siblings.add(i)
+    return siblings
+
+def is_heading_line(line):
+    """True for markdown headings, day headings and bold-only heading lines"""
+    line = line.strip()
+    return bool(HEADING_PATTERN.match(line) or DAY_HEADING_PATTERN.match(line) or BOLD_HEADING_PATTERN.match(line))
+
+def strip_reply_preamble(markdown_text):
+    """Drop chatty text a model puts before the first heading of a rewritten section"""
+    lines = markdown_text.split('\n')
+    for i, line in enumerate(lines):
+        if is_heading_line(line):
+            return '\n'.join(lines[i:])
+    return markdown_text
+
+def build_itinerary_section(markdown_text):
+    """Create a section with its title and converted LaTeX"""
+    title = ""
+    for line in markdown_text.split('\n'):
+        if line.strip():
+            title = re.sub(r'^#+\s*', '', line.strip()).replace('**', '').strip()
+            break
+    return {
+        'title': title[:120],
+        'markdown': markdown_text,
+        'latex': markdown_to_latex(markdown_text)
+    }
+
+def summarize_itinerary_sections(sections, exclude_index=None, max_chars=160):
+    """Compact one-line-per-section summary used as context when regenerating a single section"""
+    summary = []
+    for i, section in enumerate(sections):
+        if i == exclude_index:
+            continue
+        body = ' '.join(
+            line.strip().lstrip('-*# ').replace('**', '')
+            for line in section['markdown'].split('\n')[1:]
+            if line.strip()
+        )
+        if len(body) > max_chars:
+            body = body[:max_chars].rsplit(' ', 1)[0] + '...'
+        summary.append(f"- {section['title'] or f'Section {i + 1}'}: {body}")
+    return '\n'.join(summary)
+
 def get_template_config(template_id):
     """Get template-specific configurations"""
     templates = {
@@ -283,8 +490,8 @@ def generate_latex_template(destination, date_range, budget, people, days, itine
 """
     return latex_template
 
-def create_itinerary_pdf(markdown_text, places=None, options=None, template_id='modern'):
-    """Create PDF using LaTeX with the selected template"""
+def prepare_itinerary_document(markdown_text, places=None, options=None):
+    """Parse itinerary markdown and options into the render-ready fields used by the templates"""
     
     # Extract information
     destination = "Your Destination"
@@ -312,19 +519,62 @@ def create_itinerary_pdf(markdown_text, places=None, options=None, template_id='
         if options.get('people'):
             people = str(options['people'])
     
-    # Convert markdown to LaTeX
-    latex_content = markdown_to_latex(markdown_text)
+    sections = split_itinerary_sections(markdown_text)
+    
+    return {
+        'destination': destination,
+        'date_range': date_range,
+        'budget': budget,
+        'people': people,
+        'days': days,
+        'sections': sections,
+        'latex_content': '\n'.join(section['latex'] for section in sections)
+    }
+
+def replace_itinerary_section(document, section_index, markdown_text):
+    """Return a copy of the document with one section replaced, reconverting only that section
+    
+    The spliced text is split again, so a reply that would absorb or drop a
+    neighbouring section raises ValueError instead of changing the itinerary.
+    """
+    spliced = [section['markdown'] for section in document['sections']]
+    spliced[section_index] = markdown_text
+    texts = _section_texts('\n'.join(spliced))
+    if texts != spliced:
+        raise ValueError(f"Replacement for section {section_index + 1} does not form exactly one section")
+    sections = list(document['sections'])
+    sections[section_index] = build_itinerary_section(markdown_text)
+    updated = dict(document)
+    updated['sections'] = sections
+    updated['latex_content'] = '\n'.join(section['latex'] for section in sections)
+    return updated
+
+def create_itinerary_pdf(markdown_text, places=None, options=None, template_id='modern', output_path=None):
+    """Create PDF using LaTeX with the selected template"""
+    document = prepare_itinerary_document(markdown_text, places=places, options=options)
+    return render_itinerary_pdf(document, markdown_text, places=places, template_id=template_id, output_path=output_path)
+
+def render_itinerary_pdf(document, markdown_text, places=None, template_id='modern', output_path=None, fallback=True):
+    """Render a prepared itinerary document to PDF with the selected template
+
+    With output_path the result is written to that file and the path returned,
+    so it can be streamed from disk; otherwise a BytesIO is returned. With
+    fallback=False a failed LaTeX compile returns None instead of a ReportLab PDF.
+    """
+    destination = document['destination']
+    date_range = document['date_range']
+    budget = document['budget']
+    people = document['people']
+    days = document['days']
+    latex_content = document['latex_content']
     
     # Handle map image
     map_image_path = None
-    temp_map_file = None
     if places and len(places) > 0:
-        map_data = fetch_static_map(places)
-        if map_data:
-            temp_map_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            temp_map_file.write(map_data)
-            temp_map_file.close()
-            map_image_path = temp_map_file.name
+        try:
+            map_image_path = get_map_image_path(places)
+        except OSError as e:
+            print(f"Map cache unavailable, continuing without map: {e}")
     
     # Generate LaTeX document with selected template
     latex_doc = generate_latex_template(
@@ -345,11 +595,10 @@ def create_itinerary_pdf(markdown_text, places=None, options=None, template_id='
             print(f"pdflatex found, proceeding with LaTeX compilation")
             print(f"LaTeX file written to: {latex_file}")
             
-            # Copy map image if exists
+            # Link the cached map image in if exists
             if map_image_path:
                 map_dest = os.path.join(temp_dir, "map.png")
-                import shutil
-                shutil.copy2(map_image_path, map_dest)
+                link_into(map_image_path, map_dest)
             
             # Run pdflatex with proper encoding settings and error handling
             print("LaTeX compilation pass 1")
@@ -372,17 +621,15 @@ def create_itinerary_pdf(markdown_text, places=None, options=None, template_id='
             pdf_file = os.path.join(temp_dir, "itinerary.pdf")
             if os.path.exists(pdf_file):
                 print("PDF generated successfully")
+                if output_path:
+                    # Move the artifact out before the temp dir is removed
+                    shutil.move(pdf_file, output_path)
+                    return output_path
+                
                 # Read PDF and return as BytesIO
                 with open(pdf_file, 'rb') as f:
                     pdf_buffer = io.BytesIO(f.read())
                 
-                # Clean up temp map file
-                if temp_map_file:
-                    try:
-                        os.unlink(temp_map_file.name)
-                    except:
-                        pass
-                
                 return pdf_buffer
             else:
                 print(f"LaTeX compilation failed")
@@ -390,21 +637,14 @@ def create_itinerary_pdf(markdown_text, places=None, options=None, template_id='
                 print(f"stderr: {result.stderr}")
                 print(f"return code: {result.returncode}")
                 # Fall back to simple PDF
-                return create_simple_pdf_fallback(markdown_text, places, template_id)
+                return create_simple_pdf_fallback(markdown_text, places, template_id, output_path) if fallback else None
                 
     except subprocess.TimeoutExpired:
         print("LaTeX compilation timed out, falling back to simple PDF")
-        return create_simple_pdf_fallback(markdown_text, places, template_id)
+        return create_simple_pdf_fallback(markdown_text, places, template_id, output_path) if fallback else None
     except (subprocess.CalledProcessError, FileNotFoundError, UnicodeDecodeError) as e:
         print(f"LaTeX compilation error: {e}")
-        return create_simple_pdf_fallback(markdown_text, places, template_id)
-    finally:
-        # Clean up temp map file
-        if temp_map_file:
-            try:
-                os.unlink(temp_map_file.name)
-            except:
-                pass
+        return create_simple_pdf_fallback(markdown_text, places, template_id, output_path) if fallback else None
 
 def clean_text_for_reportlab(text):
     """Clean markdown text for reportlab processing"""
@@ -428,7 +668,7 @@ def clean_text_for_reportlab(text):
     
     return text
 
-def create_simple_pdf_fallback(markdown_text, places=None, template_id='modern'):
+def create_simple_pdf_fallback(markdown_text, places=None, template_id='modern', output_path=None):
     """Improved fallback PDF generation using reportlab"""
     print(f"Using fallback PDF generation with reportlab - template: {template_id}")
     
@@ -440,8 +680,8 @@ def create_simple_pdf_fallback(markdown_text, places=None, template_id='modern')
         from reportlab.lib import colors
         from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
         
-        # Create buffer
-        buffer = io.BytesIO()
+        # Create buffer, or write straight to the output file
+        buffer = output_path or io.BytesIO()
         
         # Get template colors
         template_config = get_template_config(template_id)
@@ -534,17 +774,19 @@ def create_simple_pdf_fallback(markdown_text, places=None, template_id='modern')
         
         # Build PDF
         doc.build(story)
+        if output_path:
+            return output_path
         buffer.seek(0)
         return buffer
         
     except ImportError:
         print("reportlab not available, creating simple text-based PDF")
-        return create_minimal_pdf_fallback(markdown_text, template_id)
+        return create_minimal_pdf_fallback(markdown_text, template_id, output_path)
     except Exception as e:
         print(f"Fallback PDF generation failed: {e}")
-        return create_minimal_pdf_fallback(markdown_text, template_id)
+        return create_minimal_pdf_fallback(markdown_text, template_id, output_path)
 
-def create_minimal_pdf_fallback(markdown_text, template_id='modern'):
+def create_minimal_pdf_fallback(markdown_text, template_id='modern', output_path=None):
     """Absolute minimal fallback - just return the text"""
     print("Creating minimal fallback response")
     buffer = io.BytesIO()
@@ -560,6 +802,11 @@ Generated by Bagpack AI Travel Assistant
 Have a wonderful journey!
 """.encode('utf-8')
     
+    if output_path:
+        with open(output_path, 'wb') as f:
+            f.write(simple_content)
+        return output_path
+    
     buffer.write(simple_content)
     buffer.seek(0)
     return buffer
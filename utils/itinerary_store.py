@@ -0,0 +1,146 @@
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from .cache import SingleFlight, get_cache, private_directory, user_temp_path
+from .itinerary import prepare_itinerary_document, replace_itinerary_section
+
+# How long a generated itinerary stays addressable by id
+ITINERARY_TTL_SECONDS = int(os.getenv('ITINERARY_TTL_SECONDS', 6 * 60 * 60))
+MAX_STORED_ITINERARIES = int(os.getenv('MAX_STORED_ITINERARIES', 500))
+MAX_CACHED_RENDERS = int(os.getenv('MAX_CACHED_RENDERS', 200))
+RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR', user_temp_path('bagpack-renders'))
+
+# Kept in the shared cache so any worker can serve an id created by another
+_itineraries = get_cache('itineraries', ttl=ITINERARY_TTL_SECONDS, max_entries=MAX_STORED_ITINERARIES)
+
+# Rendered PDFs live as files on local disk so they can be streamed with sendfile
+_renders = SingleFlight()
+_last_sweep = 0
+
+def save_itinerary(itinerary_text, places=None, options=None):
+    """Store a generated itinerary with its parsed, render-ready form
+
+    Returns (entry, stored). The entry is usable for rendering even when the
+    store is unavailable; its id is only addressable later if stored is True.
+    """
+    document = prepare_itinerary_document(itinerary_text, places=places, options=options)
+    itinerary_id = uuid.uuid4().hex
+    entry = {
+        'id': itinerary_id,
+        'text': itinerary_text,
+        'places': places or [],
+        'options': options or {},
+        'document': document,
+        'revision': 0,
+        'created_at': time.time()
+    }
+    stored = _itineraries.set(itinerary_id, entry)
+    return entry, stored
+
+def get_itinerary(itinerary_id):
+    """Return the stored itinerary entry, or None if unknown or expired"""
+    return _itineraries.get(itinerary_id)
+
+def _render_path(itinerary_id, template_id, revision):
+    # The revision is part of the name, so edited itineraries never see stale renders
+    template = re.sub(r'[^a-z0-9_-]', '', str(template_id).lower())[:32] or 'modern'
+    return os.path.join(RENDER_CACHE_DIR, f"{itinerary_id}-{revision}-{template}.pdf")
+
+def _sweep_renders():
+    """Drop expired render artifacts and the oldest ones beyond the cap"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < 60:
+        return
+    _last_sweep = now
+    try:
+        names = os.listdir(RENDER_CACHE_DIR)
+    except OSError as e:
+        print(f"Render cache sweep failed: {e}")
+        return
+    
+    artifacts = []
+    stale = []
+    for name in names:
+        path = os.path.join(RENDER_CACHE_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if name.endswith('.pdf'):
+            artifacts.append((mtime, path))
+        elif mtime < now - 60 * 60:
+            # Leftover one-off renders whose response never closed
+            stale.append(path)
+    artifacts.sort(reverse=True)
+    stale += [path for i, (mtime, path) in enumerate(artifacts)
+              if i >= MAX_CACHED_RENDERS or mtime < now - ITINERARY_TTL_SECONDS]
+    for path in stale:
+        try:
+            # Open handles keep streaming fine after unlink
+            os.unlink(path)
+        except OSError:
+            pass
+
+def temporary_render_path():
+    """A fresh file path next to the render cache for an uncached, one-off render"""
+    private_directory(RENDER_CACHE_DIR)
+    fd, path = tempfile.mkstemp(suffix='.tmp', dir=RENDER_CACHE_DIR)
+    os.close(fd)
+    return path
+
+def render_artifact(entry, template_id, render):
+    """Return (path, cached) for the entry's PDF, calling render(output_path) on a miss
+
+    render returns True when the output is final (a real LaTeX compile) and is
+    kept in the render cache. Fallback output is not cached; then cached is
+    False and the caller owns the file and must remove it.
+    """
+    # Checked before trusting any existing file in the directory
+    private_directory(RENDER_CACHE_DIR)
+    path = _render_path(entry['id'], template_id, entry['revision'])
+    if os.path.exists(path):
+        return path, True
+
+    def render_once():
+        if os.path.exists(path):
+            return path, True
+        output_path = temporary_render_path()
+        try:
+            final = render(output_path)
+        except Exception:
+            os.unlink(output_path)
+            raise
+        if not final:
+            return output_path, False
+        os.replace(output_path, path)
+        _sweep_renders()
+        return path, True
+
+    # One render per artifact within this process; other artifacts are not held up
+    result, shared = _renders.run(path, render_once)
+    if shared and not result[1]:
+        # The fallback file belongs to the caller that rendered it
+        return render_once()
+    return result
+
+def update_itinerary_section(itinerary_id, section_index, markdown_text):
+    """Splice a regenerated section into a stored itinerary and bump its revision
+    
+    The read-modify-write holds a backend lock, so edits made from different
+    workers at the same time are applied one after the other.
+    """
+    with _itineraries.lock(itinerary_id):
+        entry = get_itinerary(itinerary_id)
+        if entry is None:
+            return None
+        entry = dict(entry)
+        document = replace_itinerary_section(entry['document'], section_index, markdown_text)
+        entry['document'] = document
+        entry['text'] = '\n'.join(section['markdown'] for section in document['sections'])
+        entry['revision'] += 1
+        _itineraries.set(itinerary_id, entry)
+        return entry
@@ -1,11 +1,20 @@
 # --- utils/location.py ---
 import json
 import re
-import requests
+from .admission import AdmissionRejected
+from .cache import get_cache
 from .gemini_chat import get_gemini_response
 
+_geocodes = get_cache('geocode', ttl=30 * 24 * 60 * 60, max_entries=20000)
+_suggestions = get_cache('suggestions', ttl=24 * 60 * 60, max_entries=2000)
+
 def get_coordinates(place):
+    """Get coordinates for a place, reusing cached geocodes across workers"""
+    return _geocodes.get_or_set(place.strip().lower(), lambda: fetch_coordinates(place), none_ttl=5 * 60)
+
+def fetch_coordinates(place):
     """Get coordinates using OpenStreetMap Nominatim API (free)"""
+    import requests
     try:
         # Using Nominatim API (OpenStreetMap's free geocoding service)
         url = f"https://nominatim.openstreetmap.org/search"
@@ -35,6 +44,11 @@ def get_coordinates(place):
         return None
 
 def get_suggestions_from_gemini(place, coordinates):
+    """Get tourist attractions from Gemini, cached per place"""
+    key = ('nearby', place.strip().lower(), tuple(round(c, 3) for c in coordinates))
+    return _suggestions.get_or_set(key, lambda: fetch_suggestions_from_gemini(place, coordinates))
+
+def fetch_suggestions_from_gemini(place, coordinates):
     """Get tourist attractions from Gemini with descriptions"""
     try:
         prompt = f"""
@@ -56,7 +70,7 @@ def get_suggestions_from_gemini(place, coordinates):
         Only return the JSON array, no additional text.
         """
         
-        response = get_gemini_response(prompt, place)
+        response = get_gemini_response(prompt, place, task="suggestions")
         print(f"Raw Gemini suggestions response: {response}")
         
         # Try to extract JSON array from the response
@@ -70,6 +84,8 @@ def get_suggestions_from_gemini(place, coordinates):
             print("No JSON array found in Gemini response")
             return None
             
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Error getting suggestions from Gemini: {e}")
         return None
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Relative cost per call for each model, used against per-task cost budgets
+MODEL_COSTS = {
+    'gemini-2.0-flash-lite': 1,
+    'gemini-2.0-flash': 2,
+    'gemini-1.5-flash': 2,
+    'gemini-1.5-pro': 8,
+}
+
+# Ordered model tiers per call type, primary first. Interactive chat and short
+# suggestion lists start on the cheapest, fastest tier; itineraries start on the
+# stronger model. The latency budget is also each tier's per-call timeout before
+# the next tier is tried.
+DEFAULT_TASK_CONFIG = {
+    'chat': {'models': 'gemini-2.0-flash-lite,gemini-2.0-flash', 'latency_budget': 5.0, 'cost_budget': 2},
+    'suggestions': {'models': 'gemini-2.0-flash-lite,gemini-1.5-flash', 'latency_budget': 10.0, 'cost_budget': 2},
+    'itinerary': {'models': 'gemini-2.0-flash,gemini-1.5-flash,gemini-2.0-flash-lite', 'latency_budget': 25.0, 'cost_budget': 2},
+}
+
+STATS_WINDOW_SECONDS = float(os.getenv('GEMINI_STATS_WINDOW_SECONDS', 300))
+MIN_SAMPLES = int(os.getenv('GEMINI_STATS_MIN_SAMPLES', 5))
+MAX_ERROR_RATE = float(os.getenv('GEMINI_MAX_ERROR_RATE', 0.5))
+RECENT_CALLS = 100
+
+def _load_task_config():
+    """Read per-task models and budgets, allowing env overrides such as GEMINI_CHAT_MODELS"""
+    config = {}
+    for task, defaults in DEFAULT_TASK_CONFIG.items():
+        prefix = f"GEMINI_{task.upper()}"
+        models = os.getenv(f"{prefix}_MODELS", defaults['models'])
+        config[task] = {
+            'models': [name.strip() for name in models.split(',') if name.strip()],
+            'latency_budget': float(os.getenv(f"{prefix}_LATENCY_BUDGET", defaults['latency_budget'])),
+            'cost_budget': float(os.getenv(f"{prefix}_COST_BUDGET", defaults['cost_budget'])),
+        }
+    return config
+
+class ModelRouter:
+    """Pick a Gemini model per call type from rolling latency and error statistics"""
+
+    def __init__(self, task_config=None):
+        self.task_config = task_config or _load_task_config()
+        self._samples = {}
+        self._recent = deque(maxlen=RECENT_CALLS)
+        self._lock = threading.Lock()
+
+    def _prune(self, samples, now):
+        while samples and samples[0][0] < now - STATS_WINDOW_SECONDS:
+            samples.popleft()
+
+    def _model_stats(self, model_name, now):
+        samples = self._samples.get(model_name)
+        if not samples:
+            return {'calls': 0, 'errors': 0, 'error_rate': 0.0, 'avg_latency': None, 'p90_latency': None}
+        self._prune(samples, now)
+        latencies = sorted(latency for _, latency, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        calls = len(samples)
+        p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))] if latencies else None
+        return {
+            'calls': calls,
+            'errors': errors,
+            'error_rate': errors / calls if calls else 0.0,
+            'avg_latency': sum(latencies) / len(latencies) if latencies else None,
+            'p90_latency': p90,
+        }
+
+    def _is_healthy(self, model_name, latency_budget, now):
+        stats = self._model_stats(model_name, now)
+        if stats['calls'] < MIN_SAMPLES:
+            return True
+        if stats['error_rate'] > MAX_ERROR_RATE:
+            return False
+        return stats['p90_latency'] is None or stats['p90_latency'] <= latency_budget
+
+    def latency_budget(self, task):
+        return (self.task_config.get(task) or self.task_config['chat'])['latency_budget']
+
+    def candidates(self, task):
+        """Models to try for a task, in order: healthy in-budget tiers first, the rest as last resort"""
+        config = self.task_config.get(task) or self.task_config['chat']
+        affordable = [m for m in config['models'] if MODEL_COSTS.get(m, 0) <= config['cost_budget']]
+        models = affordable or config['models']
+        now = time.time()
+        with self._lock:
+            healthy = [m for m in models if self._is_healthy(m, config['latency_budget'], now)]
+            failing = {m for m in models if self._model_stats(m, now)['error_rate'] > MAX_ERROR_RATE}
+        # Unhealthy models stay at the back so a call still succeeds if every tier is degraded:
+        # slow models before failing ones, and the cheapest (fastest) tier first within each group
+        degraded = [m for m in models if m not in healthy]
+        degraded.sort(key=lambda m: (m in failing, MODEL_COSTS.get(m, 0)))
+        return healthy + degraded
+
+    def record(self, task, model_name, latency, ok):
+        """Record the outcome of one model call"""
+        now = time.time()
+        with self._lock:
+            samples = self._samples.setdefault(model_name, deque())
+            samples.append((now, latency, ok))
+            self._prune(samples, now)
+            self._recent.append({
+                'task': task,
+                'model': model_name,
+                'latency': round(latency, 3),
+                'ok': ok,
+                'at': now,
+            })
+
+    def stats(self):
+        """Per-model rolling statistics plus the most recent calls, for tuning"""
+        now = time.time()
+        with self._lock:
+            models = {name: self._model_stats(name, now) for name in self._samples}
+            recent = list(self._recent)
+        return {
+            'tasks': self.task_config,
+            'models': models,
+            'recent_calls': recent,
+        }
@@ -0,0 +1,119 @@
+import importlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Set when the app package starts importing; the reference point for the report
+PROCESS_STARTED = time.time()
+
+# Heavy modules that request handlers otherwise import on first use
+WARM_UP_MODULES = {
+    'requests': ['requests'],
+    'pil': ['PIL.Image', 'PIL.PngImagePlugin'],
+    'reportlab': [
+        'reportlab.lib.pagesizes',
+        'reportlab.platypus',
+        'reportlab.lib.styles',
+        'reportlab.lib.units',
+        'reportlab.lib.colors',
+        'reportlab.lib.enums',
+    ],
+    'gemini_sdk': ['google.generativeai'],
+}
+
+_report = {
+    'phases': {},
+    'warm_up': {},
+    'ready_after_ms': None,
+    'first_request_after_ms': None,
+}
+_lock = threading.Lock()
+_warmed_up = False
+_worker_started = PROCESS_STARTED
+
+def _after_fork_in_child():
+    # A forked worker measures its first request from its own birth
+    global _lock, _worker_started
+    _lock = threading.Lock()
+    _worker_started = time.time()
+    _report['first_request_after_ms'] = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def _elapsed_ms(since):
+    return round((time.time() - since) * 1000, 1)
+
+def record_phase(name, seconds):
+    with _lock:
+        _report['phases'][name] = round(seconds * 1000, 1)
+
+@contextmanager
+def phase(name):
+    """Time a named start-up phase for the report"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        with _lock:
+            _report['phases'][name] = _elapsed_ms(start)
+
+def warm_up():
+    """Import heavy modules and build the Gemini models ahead of the first request
+
+    Safe to call more than once. Under a pre-forking server (e.g. gunicorn with
+    --preload and WARM_UP_ON_START=1) this runs once in the master, and forked
+    workers share the already-imported pages instead of each paying for them.
+    No network connections are opened here, so nothing unsafe crosses the fork.
+    """
+    global _warmed_up
+    with _lock:
+        if _warmed_up:
+            return
+        _warmed_up = True
+
+    for name, modules in WARM_UP_MODULES.items():
+        start = time.time()
+        try:
+            for module in modules:
+                importlib.import_module(module)
+            result = _elapsed_ms(start)
+        except ImportError as e:
+            result = f"unavailable: {e}"
+        with _lock:
+            _report['warm_up'][name] = result
+
+    # Models are configured and constructed locally; their API clients are created on first call
+    from .gemini_chat import GEMINI_API_KEY, get_model, router
+    start = time.time()
+    if GEMINI_API_KEY:
+        for config in router.task_config.values():
+            for model_name in config['models']:
+                get_model(model_name)
+    with _lock:
+        _report['warm_up']['gemini_models'] = _elapsed_ms(start)
+
+def mark_ready():
+    with _lock:
+        _report['ready_after_ms'] = _elapsed_ms(PROCESS_STARTED)
+        report = dict(_report)
+    print(f"⏱️  Startup: ready after {report['ready_after_ms']}ms (phases: {report['phases']}, warm-up: {report['warm_up']})")
+
+def mark_request():
+    """Record how long after this worker started its first request was served"""
+    if _report['first_request_after_ms'] is not None:
+        return
+    with _lock:
+        if _report['first_request_after_ms'] is None:
+            _report['first_request_after_ms'] = _elapsed_ms(_worker_started)
+
+def startup_report():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'phases': dict(_report['phases']),
+            'warm_up': dict(_report['warm_up']),
+            'ready_after_ms': _report['ready_after_ms'],
+            'first_request_after_ms': _report['first_request_after_ms'],
+        }